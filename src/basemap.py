@@ -0,0 +1,112 @@
+import numpy as np
+import os
+import shapely
+from matplotlib.collections import LineCollection
+
+
+# - - - - - - - - - - - - - - - -
+# - - Street basemap layer: bounding-box culling with an STRtree and
+# - - precomputed simplified geometry tiers, cached on disk as .npz.
+# - - - - - - - - - - - - - - - -
+
+STREET_SHP_PATH = '../misc/Street_Centerlines/Street_Centerlines.shp'
+CACHE_DIR = '../misc/.basemap_cache/'
+# the DC view every map in main.py clips to: (xmin, xmax, ymin, ymax)
+DC_EXTENT = (-77.13, -76.90, 38.79, 39.0)
+# simplification tolerances (degrees) of the level-of-detail tiers, finest first
+TIER_TOLERANCES = (0.0, 1e-5, 5e-5, 2e-4)
+
+_basemaps = dict()
+
+class StreetBasemap(object):
+    """Street centerlines split into single polylines, with a spatial index over their bounding boxes and one
+    simplified copy of the vertices per level-of-detail tier.
+
+    Attributes
+    ----------
+    bounds (ndarray)
+        (lines, 4) xmin, ymin, xmax, ymax of every polyline.
+    tree (shapely.STRtree)
+        spatial index over the bounding boxes.
+    tiers (list)
+        per tier, (coords, offsets): all vertices as one (n, 2) array and the start offset of every polyline.
+
+    Parameters
+    ----------
+    shp_path (str), optional
+        shape file of the streets.
+    cache_dir (str), optional
+        where the tiers are cached; keyed by the shape file's size and modification time.
+    """
+
+    def __init__(self, shp_path=STREET_SHP_PATH, cache_dir=CACHE_DIR):
+        stat = os.stat(shp_path)
+        cache_file = os.path.join(cache_dir, f'{os.path.basename(shp_path)}.{stat.st_size}.{int(stat.st_mtime)}.npz')
+        if os.path.exists(cache_file):
+            cached = np.load(cache_file)
+            self.bounds = cached['bounds']
+            self.tiers = [(cached[f'coords{t}'], cached[f'offsets{t}']) for t in range(len(TIER_TOLERANCES))]
+        else:
+            self._build(shp_path)
+            os.makedirs(cache_dir, exist_ok=True)
+            arrays = dict(bounds=self.bounds)
+            for t, (coords, offsets) in enumerate(self.tiers):
+                arrays[f'coords{t}'] = coords
+                arrays[f'offsets{t}'] = offsets
+            np.savez(cache_file, **arrays)
+        self.tree = shapely.STRtree(shapely.box(*self.bounds.T))
+
+    def _build(self, shp_path):
+        import geopandas as gpd
+        print('building street basemap tiers (cached for later runs)...')
+        lines = np.asarray(gpd.read_file(shp_path).geometry.explode(index_parts=False).values)
+        lines = lines[~shapely.is_missing(lines)]
+        lines = lines[~shapely.is_empty(lines)]
+        self.bounds = shapely.bounds(lines)
+        self.tiers = list()
+        for tolerance in TIER_TOLERANCES:
+            simplified = (lines if tolerance == 0 else shapely.simplify(lines, tolerance, preserve_topology=False))
+            coords, index = shapely.get_coordinates(simplified, return_index=True)
+            offsets = np.searchsorted(index, np.arange(len(lines)+1))
+            self.tiers.append((coords, offsets))
+
+    def tier_for(self, extent, width_px=1000):
+        ''' coarsest tier whose tolerance stays under half a pixel for the given extent and output width. '''
+        pixel = (extent[1] - extent[0]) / width_px
+        usable = [t for t, tol in enumerate(TIER_TOLERANCES) if tol <= pixel/2]
+        return max(usable)
+
+    def visible(self, extent):
+        ''' indices of the polylines whose bounding box intersects the extent (xmin, xmax, ymin, ymax). '''
+        return np.sort(self.tree.query(shapely.box(extent[0], extent[2], extent[1], extent[3])))
+
+    def plot(self, ax, extent=DC_EXTENT, color='k', linewidth=.25, **kwargs):
+        """Draw the visible streets at the tier matching the extent as a single LineCollection.
+
+        Parameters
+        ----------
+        ax (matplotlib axis)
+            axis to draw on.
+        extent (tuple), optional
+            (xmin, xmax, ymin, ymax) of the view. Defaults to the DC view used throughout main.py.
+
+        Returns
+        -------
+        LineCollection
+            the added collection.
+        """
+
+        width_px = ax.get_figure().get_figwidth() * ax.get_figure().dpi
+        coords, offsets = self.tiers[self.tier_for(extent, width_px)]
+        idx = self.visible(extent)
+        segments = [coords[offsets[i]:offsets[i+1]] for i in idx]
+        lc = LineCollection(segments, colors=color, linewidths=linewidth, **kwargs)
+        ax.add_collection(lc)
+        ax.autoscale_view()
+        return lc
+
+def street_basemap(shp_path=STREET_SHP_PATH):
+    ''' the StreetBasemap for a shape file, loaded once per process. '''
+    if shp_path not in _basemaps:
+        _basemaps[shp_path] = StreetBasemap(shp_path)
+    return _basemaps[shp_path]
@@ -11,6 +11,14 @@ from collections import OrderedDict
 import geopandas as gpd 
 from geopy.distance import distance
 import argparse
+from basemap import street_basemap, DC_EXTENT
+from query_service import build_station_aggregates
+from trip_store import write_trip_store, TripStore, write_partitioned_store, PartitionedTripStore, add_derived
+from sketches import build_monthly_sketches, build_distinct_counters
+from memo import ResultCache, source_manifest
+from sampling import sample_rows, stratified_sample, estimate_counts, trip_count, station_rate_estimates
+from replay import DockReplay, dock_capacity
+from timeutil import DAYS, EPOCH_ORDINAL, epoch_day, day_of_week
 
 
 # PRIMARY DATA SOURCE
@@ -21,7 +29,7 @@ import argparse
 # - - NumPy/SciPy Docstring Format
 # - - - - - - - - - - - - - - - - 
  
-def pd_csv_group(data_folder,num=-1):
+def pd_csv_group(data_folder,num=-1, sample=None, seed=None):
     """Read many csv data files from a specified directory into a single data frame. 
     
     Parameters
@@ -30,6 +38,10 @@ def pd_csv_group(data_folder,num=-1):
         path to directory containing ONLY csv data files.
     num (int), optional 
         number of csv files to read and integrate into the primary dataframe. 
+    sample (float), optional
+        keep only a stratified sample of this fraction of each file's trips (see sampling.stratified_sample()).
+    seed (int), optional
+        seed of the sample, offset by the file number. 
         
     Returns
     -------
@@ -47,6 +59,9 @@ def pd_csv_group(data_folder,num=-1):
     #print('(Please be patient for ~ 30 seconds)')
     for file_num,file in enumerate(os.listdir(data_folder)):
         f = pd.read_csv(data_folder+file)
+        if sample:
+            f = stratified_sample(f, sample, f['Start station number'].values, pd.to_datetime(f['Start date']).values,
+                part=file_num, seed=(None if seed is None else seed+file_num))
         print(f'appending df #{file_num+1}...')
         df_list.append(f)
         # if there is a file number limit, stop here. 
@@ -121,6 +136,126 @@ def series_freq_dict(df, column_name):
     lst = [x.hour for x in df[column_name].values]
     return freq_dict(lst)
 
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between arrays of points given in degrees (vectorized, broadcasts). 
+
+    Parameters
+    ----------
+    lat1, lon1, lat2, lon2 (ndarray)
+        coordinates of the first and second points. 
+
+    Returns
+    -------
+    ndarray
+        distances in meters on a sphere of the mean earth radius (within ~0.5% of the geodesic distance). 
+    """
+
+    lat1, lon1, lat2, lon2 = (np.radians(x) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2-lat1)/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2-lon1)/2)**2
+    return 2*6371008.8*np.arcsin(np.sqrt(a))
+
+def trip_distance_speed(df, station_locations, max_speed=40):
+    """Straight-line distance and implied speed of every trip, from its start and end station coordinates. 
+    Terminal numbers are mapped to coordinate arrays with a sorted lookup, so the whole table is one vectorized pass. 
+
+    Parameters
+    ----------
+    df (DataFrame)
+        primary dataframe with 'TERMINAL_NUMBER' (start station), 'End station number' and 'Duration'. 
+    station_locations (DataFrame)
+        bike station locations with 'TERMINAL_NUMBER', 'LATITUDE', 'LONGITUDE'. 
+    max_speed (float), optional
+        speed (km/h) above which a trip is flagged as impossible. Defaults to `max_speed=40`.
+
+    Returns
+    -------
+    DataFrame
+        aligned with df, columns 'Trip distance' (m; NaN when a station has no location), 'Trip speed' (km/h), 
+        'Round trip' (returned to the start station, so the distance says nothing about the ride) and 
+        'Impossible speed' (faster than max_speed, or a non-positive duration). 
+    """
+
+    locs = station_locations.drop_duplicates('TERMINAL_NUMBER').sort_values(by='TERMINAL_NUMBER')
+    terminals = locs.TERMINAL_NUMBER.values
+    # append a NaN location that every unknown terminal number points to
+    lat = np.r_[locs.LATITUDE.values, np.nan]
+    lon = np.r_[locs.LONGITUDE.values, np.nan]
+
+    def lookup(terminal_numbers):
+        i = np.minimum(np.searchsorted(terminals, terminal_numbers), len(terminals)-1)
+        return np.where(terminals[i] == terminal_numbers, i, len(terminals))
+
+    start_station = df['TERMINAL_NUMBER'].values
+    end_station = df['End station number'].values
+    s, e = lookup(start_station), lookup(end_station)
+    meters = haversine(lat[s], lon[s], lat[e], lon[e])
+    duration = df['Duration'].values.astype(np.float64)
+    speed = np.divide(meters/1000, duration/3600, out=np.full(len(df), np.inf), where=duration>0)
+
+    return pd.DataFrame({'Trip distance':meters,
+        'Trip speed':speed,
+        'Round trip':start_station == end_station,
+        'Impossible speed':(speed > max_speed) | (duration <= 0)}, index=df.index)
+
+def bike_trip_chains(df):
+    """Links every trip to the previous trip of the same bike to find idle time and staff rebalancing moves. 
+    The trips are sorted once by bike and start time and every comparison is done on shifted arrays, so the 
+    full dataset is handled in a single pass without looping over bikes. 
+
+    Parameters
+    ----------
+    df (DataFrame)
+        primary dataframe with 'Bike number', 'Start timestamp', 'Duration', 'TERMINAL_NUMBER' (start station) 
+        and 'End station number' columns. 
+
+    Returns
+    -------
+    DataFrame
+        one row per trip (original index, sorted by bike and start time) with columns 'Bike number', 'Start timestamp', 
+        'Idle gap' (seconds since the bike's previous trip ended, NaN for its first trip) and 'Rebalanced' (True when the 
+        trip starts at a different station from where the bike's previous trip ended). 
+    DataFrame
+        one row per bike (indexed by 'Bike number') with columns 'TRIPS', 'RIDE_SECONDS', 'IDLE_SECONDS', 'SPAN_SECONDS', 
+        'UTILIZATION' (ride time / time between first checkout and last return) and 'REBALANCES'. 
+    """
+
+    # integer codes for the bike numbers so the sort is on two integer keys
+    bikes, bike_code = np.unique(np.asarray(df['Bike number'].values, dtype=str), return_inverse=True)
+    start = df['Start timestamp'].values.astype(np.int64)
+    order = np.lexsort((start, bike_code))
+
+    bike_code = bike_code[order]
+    start = start[order]
+    end = start + df['Duration'].values.astype(np.int64)[order]
+    from_station = df['TERMINAL_NUMBER'].values[order]
+    to_station = df['End station number'].values[order]
+
+    # - - - compare each trip with the one before it (shifted by one row); only valid within the same bike
+    same_bike = np.zeros(len(order), dtype=bool)
+    same_bike[1:] = bike_code[1:] == bike_code[:-1]
+    idle_gap = np.full(len(order), np.nan)
+    idle_gap[1:] = np.where(same_bike[1:], start[1:] - end[:-1], np.nan)
+    rebalanced = np.zeros(len(order), dtype=bool)
+    rebalanced[1:] = same_bike[1:] & (from_station[1:] != to_station[:-1])
+
+    trips = pd.DataFrame({'Bike number':bikes[bike_code], 'Start timestamp':start, 'Idle gap':idle_gap, 'Rebalanced':rebalanced},
+        index=df.index.values[order])
+
+    # - - - per-bike totals: each bike is a contiguous run of rows, so reduce over the run boundaries
+    first = np.flatnonzero(~same_bike)
+    last = np.r_[first[1:], len(order)] - 1
+    ride_seconds = np.add.reduceat(end - start, first)
+    span_seconds = end[last] - start[first]
+    summary = pd.DataFrame({
+        'TRIPS':last - first + 1,
+        'RIDE_SECONDS':ride_seconds,
+        'IDLE_SECONDS':np.add.reduceat(np.nan_to_num(idle_gap), first),
+        'SPAN_SECONDS':span_seconds,
+        'UTILIZATION':np.divide(ride_seconds, span_seconds, out=np.ones(len(first)), where=span_seconds>0),
+        'REBALANCES':np.add.reduceat(rebalanced.astype(np.int64), first)},
+        index=pd.Index(bikes[bike_code[first]], name='Bike number'))
+    return trips, summary
+
 class BikeReport(object):
     """Creates an instance of the BikeReport object. 
 
@@ -130,6 +265,12 @@ class BikeReport(object):
         bike-specific identification number. Example, "W32432".
     duration (dict) 
         dictionary representation of the duration of bike service life as determined from the data given        
+    rebalances (int)
+        number of times the bike was moved between trips by staff (only when `chains` is given).
+    idle (dict)
+        dictionary representation of the total time the bike sat docked between trips (only when `chains` is given).
+    utilization (float)
+        fraction of the bike's active span spent on trips (only when `chains` is given).
     
     Parameters
     ----------
@@ -137,15 +278,28 @@ class BikeReport(object):
         dataframe that contains the bike of interest.
     bike_number (str)
         bike-specific identification number. Example, "W32432". 
+    chains (DataFrame), optional
+        the per-bike summary returned by bike_trip_chains(). Computed once and shared across reports. 
     """
 
-    def __init__(self, df, bike_number):
+    def __init__(self, df, bike_number, chains=None):
         self.bike_number = bike_number
         self.duration = lifetime(df[df['Bike number'] ==bike_number].agg({'Duration':'sum'}).Duration )  
         self.trips = df[df['Bike number'] ==bike_number].count()[0]
+        self.rebalances = None
+        self.idle = None
+        self.utilization = None
+        if chains is not None:
+            chain = chains.loc[bike_number]
+            self.rebalances = int(chain.REBALANCES)
+            self.idle = lifetime(int(chain.IDLE_SECONDS))
+            self.utilization = round(float(chain.UTILIZATION), 4)
 
     def __repr__(self):
-        return f'<BikeReport.obj>\n\tBikeNumber:{self.bike_number}\n\tServiceLifetime:{self.duration}\n\tTotalTrips:{self.trips}'
+        report = f'<BikeReport.obj>\n\tBikeNumber:{self.bike_number}\n\tServiceLifetime:{self.duration}\n\tTotalTrips:{self.trips}'
+        if self.rebalances is not None:
+            report += f'\n\tRebalances:{self.rebalances}\n\tIdleTime:{self.idle}\n\tUtilization:{self.utilization}'
+        return report
 
     def lifetime(self):
         dct = {}
@@ -213,7 +367,12 @@ def station_super_dict(df,popular_stations_df):
             station_by_hour = station_groups.get_group(station+' ')
         
         # - - - The super-dict's keys are the station names, and the super-dict's values for each key are the time this station 
-        station_time_hist[station] = series_freq_dict(station_by_hour, 'Start time')
+        if 'Sample weight' in station_by_hour.columns:
+            # a stratified sample (--sample) counts each ride as the number of rides it stands for
+            hours = station_by_hour['Start timestamp'].values % 86400 // 3600
+            station_time_hist[station] = {hr:int(round(w)) for hr,w in station_by_hour['Sample weight'].groupby(hours).sum().items()}
+        else:
+            station_time_hist[station] = series_freq_dict(add_derived(station_by_hour), 'Start time')
     return station_time_hist
 
 def read_shapefile(sf):
@@ -274,7 +433,7 @@ def plot_popstations(popstations_df, name):
     fig.suptitle(f'Top Ten Capital Bikeshare Stations \n Bike Rentals Per Hour in the {name}',fontsize=18)
     plt.subplots_adjust(hspace=0.5)
 
-def plot_geomap(popstation, daytime_rides, daytime,hardstop=False, metrolines=False, metrostations=False,title=None):
+def plot_geomap(popstation, daytime_rides, daytime,hardstop=False, metrolines=False, metrostations=False,title=None, extent=DC_EXTENT):
     """Plot the bike stations and lines from start to end for bike rides. 
     
     Parameters
@@ -291,6 +450,8 @@ def plot_geomap(popstation, daytime_rides, daytime,hardstop=False, metrolines=Fa
         load and plot the geometry for the metro rail routes
     metrostations (bool)
         load and plot the geometry for the metro rail stations
+    extent (tuple)
+        (xmin, xmax, ymin, ymax) of the map view. Only the streets inside it are drawn. Defaults to all of DC. 
 
     Returns
     -------
@@ -303,21 +464,18 @@ def plot_geomap(popstation, daytime_rides, daytime,hardstop=False, metrolines=Fa
     wash_shp_path = '../misc/Washington_DC_Boundary/Washington_DC_Boundary.shp'
     gpd_washborder = gpd.read_file(wash_shp_path)
     
-    # - - - READ IN SHAPE FILE FOR STREET MAP OF DC
-    street_shp_path = '../misc/Street_Centerlines/Street_Centerlines.shp'
-    gpd_street = gpd.read_file(street_shp_path)
-
     # - - - PLOT DC STREET LINES AND BORDER POLYGON 
+    # (streets come from the culled and simplified basemap layer, see basemap.py)
     plt.style.use('ggplot')
     fig,ax = plt.subplots(figsize=(15,15))
-    gpd_street.geometry.plot(ax = ax, color='k', linewidth=.25 )  
+    street_basemap().plot(ax, extent=extent, color='k', linewidth=.25)
     gpd_washborder.geometry.plot(ax = ax, color = 'grey', linewidth  =.5, alpha = .3)
 
     # - - - if kwarg 'metro' is not set to False
     if metrolines:
         metro_lines = gpd.read_file('../misc/Metro_Lines/Metro_Lines.shp')
         c = metro_lines.NAME.values
-        for num in range(len(metro_lines)-1):
+        for num in range(len(metro_lines)):
             c= metro_lines.NAME[num]
             gpd.GeoSeries(metro_lines.iloc[num].geometry).plot(ax = ax, color = c, label=f'Metro Rail: {c.capitalize()} Line')
         ax.legend()
@@ -375,8 +533,8 @@ def plot_geomap(popstation, daytime_rides, daytime,hardstop=False, metrolines=Fa
                     break
     
     # - - - make it sexy
-    ax.set_xlim(-77.13,-76.90)
-    ax.set_ylim(38.79,39)
+    ax.set_xlim(extent[0],extent[1])
+    ax.set_ylim(extent[2],extent[3])
     plt.xlabel('Longitude ($^\circ$West)')
     plt.ylabel('Latitude ($^\circ$North)')
     if title:
@@ -409,8 +567,90 @@ def print_args(args):
     else:
         dflim = -1
         print(f'dflim \t{dflim}')
+    print(f'--aggregates \t{args.aggregates}')
+    print(f'--store \t{args.store}')
+    print(f'--fromstore \t{args.fromstore}')
+    print(f'--dataset \t{args.dataset}')
+    print(f'--fromdataset \t{args.fromdataset} ({args.startdate} - {args.enddate})')
+    print(f'--sketches \t{args.sketches}')
+    print(f'--distinct \t{args.distinct}')
+    print(f'--cache \t{args.cache} ({args.cachesize}MB)')
+    print(f'--sample \t{args.sample} (seed {args.seed})')
+    print(f'--replay \t{args.replay}')
     print('-'*72)
 
+def weekday_hour_histograms(df):
+    """Counts rides by (station, day of week, hour of day) for every station at once. 
+
+    Parameters
+    ----------
+    df (DataFrame)
+        primary dataframe with 'TERMINAL_NUMBER' and 'Start timestamp' columns. 
+
+    Returns
+    -------
+    ndarray
+        sorted station terminal numbers. 
+    ndarray
+        ride counts of shape (stations, 7, 24); day 0 is Monday. 
+    """
+
+    terminals, st_idx = np.unique(df['TERMINAL_NUMBER'].values, return_inverse=True)
+    ts = df['Start timestamp'].values.astype(np.int64)
+    dayofweek = day_of_week(epoch_day(ts))
+    hour = ts % 86400 // 3600
+    counts = np.bincount((st_idx*7 + dayofweek)*24 + hour, minlength=len(terminals)*7*24)
+    return terminals, counts.reshape(len(terminals), 7, 24)
+
+def _gaussian_weights(grid, centers, bandwidth):
+    ''' (stations, len(grid), len(centers)) gaussian kernel values for a per-station bandwidth. '''
+    u = (grid[None, :, None] - centers[None, None, :]) / bandwidth[:, None, None]
+    return np.exp(-0.5*u**2) / (np.sqrt(2*np.pi)*bandwidth[:, None, None])
+
+def binned_kde(counts, gridsize=100, xlim=(-0.5,6.5), ylim=(0,23)):
+    """Gaussian KDE of the (day of week, hour) ride distribution, evaluated on a grid for every station at once. 
+    Since both variables are discrete, the 7 x 24 histogram holds the data exactly and the KDE is a separable 
+    kernel sum over the bins (Kx @ H @ Ky.T) instead of over every ride. Bandwidths follow Scott's rule per 
+    station and axis, as scipy's gaussian_kde (used by sns.jointplot(kind='kde')) does. 
+
+    Parameters
+    ----------
+    counts (ndarray)
+        ride counts of shape (stations, 7, 24) from weekday_hour_histograms(). 
+    gridsize (int), optional
+        number of evaluation points along each axis. 
+    xlim, ylim (tuple), optional
+        extent of the day-of-week and hour axes. 
+
+    Returns
+    -------
+    dict
+        'x', 'y': grid coordinates; 'joint': densities of shape (stations, gridsize, gridsize) indexed [station, y, x]; 
+        'marginal_x', 'marginal_y': marginal densities of shape (stations, gridsize). 
+    """
+
+    counts = np.asarray(counts, dtype=np.float64)
+    days, hours = np.arange(7.0), np.arange(24.0)
+    n = counts.sum(axis=(1,2))
+    n_safe = np.maximum(n, 1)
+    px = counts.sum(axis=2) / n_safe[:, None]
+    py = counts.sum(axis=1) / n_safe[:, None]
+    std_x = np.sqrt((px*(days - (px*days).sum(axis=1, keepdims=True))**2).sum(axis=1))
+    std_y = np.sqrt((py*(hours - (py*hours).sum(axis=1, keepdims=True))**2).sum(axis=1))
+    # a station whose rides all fall on one day/hour has no spread; fall back to one bin
+    std_x = np.where(std_x > 0, std_x, 1.0)
+    std_y = np.where(std_y > 0, std_y, 1.0)
+
+    x = np.linspace(xlim[0], xlim[1], gridsize)
+    y = np.linspace(ylim[0], ylim[1], gridsize)
+    # Scott's rule: n**(-1/(d+4)) times the data standard deviation
+    kx = _gaussian_weights(x, days, std_x*n_safe**(-1/6))
+    ky = _gaussian_weights(y, hours, std_y*n_safe**(-1/6))
+    joint = np.einsum('syj,sij,sxi->syx', ky, counts, kx, optimize=True) / n_safe[:, None, None]
+    marginal_x = np.einsum('sxi,si->sx', _gaussian_weights(x, days, std_x*n_safe**(-1/5)), px)
+    marginal_y = np.einsum('syj,sj->sy', _gaussian_weights(y, hours, std_y*n_safe**(-1/5)), py)
+    return dict(x=x, y=y, joint=joint, marginal_x=marginal_x, marginal_y=marginal_y)
+
 class StationStats(object):
     def __init__(self, df, station_terminal_number):
         self.station_id = station_terminal_number
@@ -419,7 +659,7 @@ class StationStats(object):
             ''' Gets the ride rate of a given station by hour for each day Mon-Sun. Returned as a dictionary of dictionaries'''
 
             # define keys for dictionaries
-            days = list(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'])
+            days = list(DAYS)
             hours = list(f'{x}hr_rates' for x in range(24))
             
             # super dict (dict of dicts) for each day and each hour of each day
@@ -430,7 +670,8 @@ class StationStats(object):
             
             # isolate the columns we care about
             cols_we_care_about = ['Start date', 'TERMINAL_NUMBER','Start time', 'End time' ]
-            df_filtered_for_terminal = df[terminal_number_mask][cols_we_care_about].copy()
+            # (a trip store loaded with derived=False only gets the datetime columns for this station's rides)
+            df_filtered_for_terminal = add_derived(df[terminal_number_mask])[cols_we_care_about].copy()
             df_filtered_for_terminal['Start date'] = df_filtered_for_terminal['Start date'].apply(lambda x: str(x))
             # extract and separate the date and the time from the timestamp
             df_filtered_for_terminal['Timestamp_date'] = df_filtered_for_terminal['Start date'].map(lambda x: x.split(' ')[0])
@@ -451,11 +692,24 @@ class StationStats(object):
                 for hr, grp in dategroup.groupby('Timestamp_hour'):
                     dct[dayname][f'{hr}hr_rates'].append(grp.size)
             return dct
-        self.rates = calc_station_rates(self, df, station_terminal_number)
+        # a stratified sample (--sample) holds too few rides per station-day for the per-day rates; it is scaled back up
+        # to estimated mean rates with confidence bounds instead (see sampling.station_rate_estimates())
+        self.sampled = 'Sample weight' in df.columns
+        if self.sampled:
+            self.estimates = station_rate_estimates(df, station_terminal_number)
+        else:
+            self.rates = calc_station_rates(self, df, station_terminal_number)
         
     def info(self, daystring):
-        ''' returns dataframe of stats for the given bike station's mean, median, and varience of useage by hour for the given day in 'daystring'. '''
+        ''' returns dataframe of stats for the given bike station's mean, median, and varience of useage by hour for the given day in 'daystring'. 
+        For a sampled dataframe: the estimated mean rate (over every such day, including days without rides) with its 95% bounds (CI_LOW, CI_HIGH). '''
         
+        if self.sampled:
+            estimates = self.estimates.loc[daystring]
+            return pd.DataFrame({'MEAN':estimates.RATE.round(3).values,
+                'CI_LOW':estimates.CI_LOW.round(3).values,
+                'CI_HIGH':estimates.CI_HIGH.round(3).values}, index=[f'{hr}hr_rates' for hr in range(24)])
+
         data = [{'MEAN':(round(np.mean(val),3) if len(val)>0 else 0), \
             'MEDIAN':(round(np.median(val),3) if len(val)>0 else 0), \
             'VARIANCE':(round(np.var(val),3) if len(val)>0 else 0)} \
@@ -463,42 +717,178 @@ class StationStats(object):
         
         return pd.DataFrame(data, index = self.rates[daystring].keys() )
 
-    def kde(self, colname= 'MEDIAN'):
+    def kde(self, colname= 'MEDIAN', density=None):
+        """Plots the day-of-week / hour-of-day density of rides at this station from a binned KDE. 
+
+        Parameters
+        ----------
+        colname (str), optional
+            used in the plot title. 
+        density (tuple), optional
+            (terminals, binned_kde() result) precomputed for all stations; computed for this station alone if not given. 
+
+        Returns
+        -------
+        JointGrid
+            the seaborn grid holding the plot. 
+        """
         print('working kde plot...')
-        station_df = self.rides[['Start date', 'TERMINAL_NUMBER']].copy()
-        station_df['dayofweek'] = pd.to_datetime(station_df['Start date'].values).dayofweek
-        station_df['hour'] = pd.to_datetime(station_df['Start date'].values).hour
-        
-        x = station_df['dayofweek']
-        y = station_df['hour']
-        g = sns.jointplot(x,y,kind='kde',color='blue',xlim=(-0.5,6.5),ylim=(0,23), space=0);
+        if density is None:
+            terminals, counts = weekday_hour_histograms(self.rides)
+            density = (terminals, binned_kde(counts))
+        terminals, grid = density
+        i = int(np.searchsorted(terminals, self.station_id))
+        if i == len(terminals) or terminals[i] != self.station_id:
+            raise KeyError(f'no density for station terminal number {self.station_id}')
+
+        color = 'blue'
+        g = sns.JointGrid(xlim=(-0.5,6.5), ylim=(0,23), space=0)
+        g.ax_joint.contourf(grid['x'], grid['y'], grid['joint'][i], levels=10, cmap=sns.light_palette(color, as_cmap=True))
+        g.ax_marg_x.fill_between(grid['x'], grid['marginal_x'][i], color=color, alpha=.25)
+        g.ax_marg_x.plot(grid['x'], grid['marginal_x'][i], color=color)
+        g.ax_marg_y.fill_betweenx(grid['y'], grid['marginal_y'][i], color=color, alpha=.25)
+        g.ax_marg_y.plot(grid['marginal_y'][i], grid['y'], color=color)
         tics = list(range(0,25,2))
         g.ax_joint.set_yticks(tics)  
-        g.fig.suptitle(f"{colname.capitalize()} Bike Station Utilization \n {self.rides['Start station'].values[0]}") # can also get the figure from plt.gcf()
+        station_name = (self.rides['Start station'].values[0] if 'Start station' in self.rides else self.rides['ADDRESS'].values[0])
+        g.fig.suptitle(f"{colname.capitalize()} Bike Station Utilization \n {station_name}") # can also get the figure from plt.gcf()
         g.set_axis_labels('Day of Week','Time of Day (0-24)' )
+        g.ax_joint.set_xticks(range(-1,7))
         g.ax_joint.set_xticklabels(['','Mon','Tue','Wen','Thu','Fri','Sut','Sun'])
+        # setting the ticks widens the view, so restore the jointplot limits
+        g.ax_joint.set_xlim(-0.5,6.5)
+        g.ax_joint.set_ylim(0,23)
         print(' ... done')
         return g
 
-def plot_geoms(lines=False, metrostations=False, bikestations=False, title=None):
+class StationFlow(object):
+    """Departures, arrivals and net flow for every station on a fixed time grid over the whole history. 
+    Each ride is reduced to an integer (station, bucket) code and accumulated with np.add.at (or a sparse 
+    COO sum for long ranges), so there are no pandas groupbys involved. 
+
+    Attributes
+    ----------
+    terminals (ndarray)
+        sorted terminal numbers of every station seen as a start or end station; the row index of the flow arrays. 
+    bucket_start (ndarray)
+        datetime64 start time of each bucket; the column index of the flow arrays. 
+    departures, arrivals (ndarray or scipy.sparse.csr_matrix)
+        station x bucket ride counts. 
+    net (ndarray or scipy.sparse.csr_matrix)
+        arrivals - departures (bikes gained by the station during the bucket). 
+
+    Parameters
+    ----------
+    df (DataFrame)
+        primary dataframe with 'TERMINAL_NUMBER' (start station), 'End station number', 'Start timestamp' and 'Duration'. 
+    bucket_minutes (int), optional
+        width of the time buckets. Defaults to `bucket_minutes=15`.
+    sparse (bool), optional
+        store the station x bucket arrays as scipy sparse matrices. Defaults to dense when the grid has fewer 
+        than 50M cells and sparse otherwise. 
+    """
+
+    def __init__(self, df, bucket_minutes=15, sparse=None):
+        width = bucket_minutes*60
+        start = df['Start timestamp'].values.astype(np.int64)
+        end = start + df['Duration'].values.astype(np.int64)
+        start_station = df['TERMINAL_NUMBER'].values
+        end_station = df['End station number'].values
+
+        self.terminals = np.union1d(np.unique(start_station), np.unique(end_station))
+        t_0 = start.min() - start.min() % width
+        n_buckets = int((end.max() - t_0)//width) + 1
+        self.bucket_minutes = bucket_minutes
+        self.bucket_start = (t_0 + width*np.arange(n_buckets)).astype('datetime64[s]')
+
+        # integer bucket codes for the checkout and the return of every ride
+        dep_row, dep_col = np.searchsorted(self.terminals, start_station), (start - t_0)//width
+        arr_row, arr_col = np.searchsorted(self.terminals, end_station), (end - t_0)//width
+        shape = (len(self.terminals), n_buckets)
+
+        self.sparse = (shape[0]*shape[1] > 50e6 if sparse is None else sparse)
+        if self.sparse:
+            from scipy.sparse import coo_matrix
+            # duplicate (row, col) entries are summed when converting to csr
+            ones = np.ones(len(start), dtype=np.int32)
+            self.departures = coo_matrix((ones, (dep_row, dep_col)), shape=shape).tocsr()
+            self.arrivals = coo_matrix((ones, (arr_row, arr_col)), shape=shape).tocsr()
+        else:
+            self.departures = np.zeros(shape, dtype=np.int32)
+            self.arrivals = np.zeros(shape, dtype=np.int32)
+            np.add.at(self.departures, (dep_row, dep_col), 1)
+            np.add.at(self.arrivals, (arr_row, arr_col), 1)
+        self.net = self.arrivals - self.departures
+
+    def _dense_rows(self, rows):
+        net = self.net[rows]
+        return (net.toarray() if self.sparse else net)
+
+    def cumulative_imbalance(self, terminal_number=None):
+        ''' running sum of the net flow (bikes gained since the start of the history). For one station if 
+        terminal_number is given (1-D), otherwise for all stations (station x bucket; dense, so mind the size for long ranges). '''
+        if terminal_number is None:
+            return np.cumsum(self._dense_rows(slice(None)), axis=1)
+        row = int(np.searchsorted(self.terminals, terminal_number))
+        if row == len(self.terminals) or self.terminals[row] != terminal_number:
+            raise KeyError(f'no rides at station terminal number {terminal_number}')
+        return np.cumsum(self._dense_rows(slice(row, row+1))[0])
+
+    def worst_windows(self, chunk=64):
+        """Finds, for every station, the window with the largest net loss of bikes (the station running empty) and the 
+        window with the largest net gain (the station filling up), from the cumulative-imbalance curve. 
+
+        Parameters
+        ----------
+        chunk (int), optional
+            number of stations whose dense curves are held in memory at once. 
+
+        Returns
+        -------
+        DataFrame
+            Columns: TERMINAL_NUMBER, WORST_DRAIN, DRAIN_START, DRAIN_END, WORST_FILL, FILL_START, FILL_END. 
+            Sorted by WORST_DRAIN descending. 
+        """
+        width = np.timedelta64(self.bucket_minutes*60, 's')
+        rows = list()
+        for lo in range(0, len(self.terminals), chunk):
+            # prepend a zero column so a window may start before the first bucket
+            curve = np.zeros((min(chunk, len(self.terminals)-lo), self.net.shape[1]+1), dtype=np.int64)
+            np.cumsum(self._dense_rows(slice(lo, lo+chunk)), axis=1, out=curve[:, 1:])
+            drain = np.maximum.accumulate(curve, axis=1) - curve
+            fill = curve - np.minimum.accumulate(curve, axis=1)
+            drain_end = drain.argmax(axis=1)
+            fill_end = fill.argmax(axis=1)
+            for i in range(curve.shape[0]):
+                # the window starts at the last peak (trough) before its end
+                drain_start = curve[i, :drain_end[i]+1].argmax()
+                fill_start = curve[i, :fill_end[i]+1].argmin()
+                rows.append(dict(TERMINAL_NUMBER=self.terminals[lo+i],
+                    WORST_DRAIN=int(drain[i, drain_end[i]]),
+                    DRAIN_START=self.bucket_start[0] + drain_start*width,
+                    DRAIN_END=self.bucket_start[0] + drain_end[i]*width,
+                    WORST_FILL=int(fill[i, fill_end[i]]),
+                    FILL_START=self.bucket_start[0] + fill_start*width,
+                    FILL_END=self.bucket_start[0] + fill_end[i]*width))
+        return pd.DataFrame(rows).sort_values(by='WORST_DRAIN', ascending=False).reset_index(drop=True)
+
+def plot_geoms(lines=False, metrostations=False, bikestations=False, title=None, extent=None):
     # - - - READ IN SHAPE FILE FOR BORDER OF DC
     # data source: https://opendata.dc.gov/datasets/23246020d6894453bdfcee00956df818_41
     gpd_washborder = gpd.read_file('../misc/Washington_DC_Boundary/Washington_DC_Boundary.shp')
-    
-    # - - - READ IN SHAPE FILE FOR STREET MAP OF DC
-    gpd_street = gpd.read_file('../misc/Street_Centerlines/Street_Centerlines.shp')
 
     # - - - PLOT DC STREET LINES AND BORDER POLYGON 
+    # only the streets inside the view are drawn, simplified to its zoom level (see basemap.py)
     plt.style.use('ggplot')
     fig,ax = plt.subplots(figsize=(10,10))
-    gpd_street.geometry.plot(ax = ax, color='k', linewidth=.25 )  
+    street_basemap().plot(ax, extent=(extent if extent else DC_EXTENT), color='k', linewidth=.25)
     gpd_washborder.geometry.plot(ax = ax, color = 'grey', linewidth  =.5, alpha = .3)
 
     # - - - if kwarg 'metro' is not set to False
     if lines:
         metro_lines = gpd.read_file('../misc/Metro_Lines/Metro_Lines.shp')
         c = metro_lines.NAME.values
-        for num in range(len(metro_lines)-1):
+        for num in range(len(metro_lines)):
             c= metro_lines.NAME[num]
             gpd.GeoSeries(metro_lines.iloc[num].geometry).plot(ax = ax, color = c, label=f'Metro Rail: {c.capitalize()} Line')
         ax.legend()
@@ -511,11 +901,14 @@ def plot_geoms(lines=False, metrostations=False, bikestations=False, title=None)
     if bikestations:
 
         ax.scatter(station_locations.LONGITUDE.values,station_locations.LATITUDE.values, c='b',alpha=.4, marker='o',label='Captial Bikeshare Bikestations')
-        ax.set_xlim(-77.13,-76.90)
-        ax.set_ylim(38.79,39)
+        ax.set_xlim(DC_EXTENT[0],DC_EXTENT[1])
+        ax.set_ylim(DC_EXTENT[2],DC_EXTENT[3])
         plt.xlabel('Longitude ($^\circ$West)')
         plt.ylabel('Latitude ($^\circ$North)')
         ax.legend()
+    if extent:
+        ax.set_xlim(extent[0],extent[1])
+        ax.set_ylim(extent[2],extent[3])
     if title:
         ax.set_title(title, fontsize=20)
     else:
@@ -545,8 +938,11 @@ def popular_stations(df,time_start,time_stop, top_n=10):
     min_f = time_stop[2:4]
     t_f = dt.time(int(hr_f), int(min_f),59)
 
-    # filter the primary df by "Start time" column with values between (lower bound) t_0 and (upper bound) t_f
-    df_time_filtered = time_filter(df, 'Start time', t_0, t_f)
+    # filter the primary df by start time of day with values between (lower bound) t_0 and (upper bound) t_f,
+    # on the integer 'Start timestamp' so no datetime objects are needed
+    time_of_day = df['Start timestamp'].values % 86400
+    time_mask = (time_of_day >= t_0.hour*3600 + t_0.minute*60) & (time_of_day <= t_f.hour*3600 + t_f.minute*60 + t_f.second)
+    df_time_filtered = df[time_mask]
 
     # group this filtered dataframe subset by terminal number from which bike is checked out from,
     # get the frequency via ".size()", 
@@ -560,6 +956,16 @@ def popular_stations(df,time_start,time_stop, top_n=10):
         .rename(columns={0:'RIDE_COUNT'})\
         .sort_values(by='RIDE_COUNT', ascending=False)[0:top_n]\
         .merge(station_locations, on='TERMINAL_NUMBER', how='left')
+
+    # a stratified sample (--sample) is scaled back up to estimated ride counts with 95% confidence bounds
+    if 'Sample weight' in df.columns:
+        estimates = estimate_counts(df, 'TERMINAL_NUMBER', mask=time_mask)\
+            .sort_values(by='ESTIMATE', ascending=False)[0:top_n]
+        popular_daytime_stations = pd.DataFrame({'TERMINAL_NUMBER':estimates.index.values,
+            'RIDE_COUNT':np.round(estimates.ESTIMATE.values).astype(np.int64),
+            'RIDE_COUNT_LOW':np.round(estimates.CI_LOW.values).astype(np.int64),
+            'RIDE_COUNT_HIGH':np.round(estimates.CI_HIGH.values).astype(np.int64)})\
+            .merge(station_locations, on='TERMINAL_NUMBER', how='left')
     return popular_daytime_stations     
 
 def bikestations_near_railstations(max_distance=200, showplot=False):
@@ -577,9 +983,6 @@ def bikestations_near_railstations(max_distance=200, showplot=False):
     A dictionary with keys as rail stations will have values that are a list of tuples -> (bikestation_terminal_number, distance from rail station) 
     '''
     distances = dict()
-    if showplot:
-        plot_geoms(lines=True, metrostations=True,bikestations=True)
-
     flagged_bikestations=list()
     lineplot = None
     for bs in bikestation_coords:
@@ -594,16 +997,119 @@ def bikestations_near_railstations(max_distance=200, showplot=False):
                 except KeyError as err:
                     distances[rs[2]]=list()
                     distances[rs[2]].append((bs,dist))
-                if showplot:
-                    x = [bs[0], rs[0]]
-                    y = [bs[1], rs[1]]
-                    lineplot =plt.plot(x,y,'g--',linewidth=.85)
-                    plt.scatter(bs[0], bs[1],color='r')
+    if showplot:
+        lineplot = plot_bikestations_near_railstations(distances)
     filtered_stations_df  = station_locations[station_locations.TERMINAL_NUMBER.isin(flagged_bikestations)].copy()
     filtered_stations_df.reset_index(inplace=True)
     filtered_stations_df.drop('index', axis=1,inplace=True)
     return filtered_stations_df,distances,lineplot
 
+def plot_bikestations_near_railstations(distances):
+    '''plots the rail stations and every bike station in the distances dictionary from bikestations_near_railstations(), 
+    with a line from each bike station to its nearby rail station. Returns the matplotlib object of the last line plotted. 
+    '''
+
+    metro_stations = gpd.read_file('../misc/Metro_Stations_in_DC/Metro_Stations_in_DC.shp')
+    rail_coords = dict(zip(metro_stations.NAME, zip(metro_stations.geometry.x,metro_stations.geometry.y)))
+    plot_geoms(lines=True, metrostations=True,bikestations=True)
+    lineplot = None
+    for rs_name, close_bikestations in distances.items():
+        rs = rail_coords[rs_name]
+        for bs, dist in close_bikestations:
+            x = [bs[0], rs[0]]
+            y = [bs[1], rs[1]]
+            lineplot =plt.plot(x,y,'g--',linewidth=.85)
+            plt.scatter(bs[0], bs[1],color='r')
+    return lineplot
+
+def weekly_station_volume(df, terminals):
+    '''returns a dataframe of the weekly rental volume of each of the given bike stations (columns, by terminal number as str) 
+    for every "year-week" of 2010-2019 (index). 
+    '''
+
+    stations_near_rail_df = df[df['TERMINAL_NUMBER'].isin(terminals)] 
+    weekly_sum_of_rentals_by_station_df = pd.DataFrame(index = [f'{yr}-{wknum}' for yr in range(2010,2020) for wknum in range(1,54) ],
+    columns=[str(x) for x in sorted(list(terminals))],data=0)
+    
+    for station in sorted(list(terminals)):
+        
+        station_df = stations_near_rail_df[stations_near_rail_df['TERMINAL_NUMBER'] == station].copy().sort_values(by='Start timestamp')
+        station_df['Start date ordinal'] = epoch_day(station_df['Start timestamp'].values) + EPOCH_ORDINAL
+        grpby_dt = station_df.groupby('Start date ordinal')
+        print(f'Aggregating daily usage for Station {station}')
+        
+        for daynum,group_df in grpby_dt:
+            weeknum = dt.date.isocalendar(dt.date.fromordinal(daynum))[1] 
+            yr =dt.date.isocalendar(dt.date.fromordinal(daynum))[0]
+            index_for_df = f'{yr}-{weeknum}'
+            weekly_sum_of_rentals_by_station_df.loc[index_for_df, str(station)]+=int(round(trip_count(group_df)))
+    return weekly_sum_of_rentals_by_station_df
+
+def _point_segment_distance(px, py, ax, ay, bx, by):
+    ''' elementwise distance from points (px, py) to segments (ax, ay)-(bx, by); inputs broadcast against each other. '''
+    dx, dy = bx - ax, by - ay
+    length_sq = dx*dx + dy*dy
+    # projection of the point onto the segment, clamped to its ends (zero-length segments use the start vertex)
+    t = np.clip(np.divide((px - ax)*dx + (py - ay)*dy, length_sq, out=np.zeros(np.broadcast(px, length_sq).shape), where=length_sq>0), 0, 1)
+    return np.hypot(px - (ax + t*dx), py - (ay + t*dy))
+
+def bikestations_to_raillines(stations, metro_lines_path='../misc/Metro_Lines/Metro_Lines.shp', max_distance=None, crs=26985):
+    """Distance from every bike station to the nearest point on each Metro rail line. 
+
+    Both layers are projected to a metric CRS (Maryland State Plane, EPSG:26985, by default) and the line 
+    geometries are broken into straight segments, so the distances are exact point-to-segment distances 
+    computed with array math instead of a geodesic loop over pairs. 
+
+    Parameters
+    ----------
+    stations (dataframe)
+        bike stations with 'TERMINAL_NUMBER', 'LATITUDE' and 'LONGITUDE' columns (e.g. station_locations). 
+    metro_lines_path (str), optional
+        shape file of the Metro rail lines. 
+    max_distance (float), optional
+        only resolve distances up to this many meters; segments farther away are skipped through a spatial 
+        index over the segments and the table holds inf for lines with no segment that close. 
+        Defaults to `max_distance=None` (every distance). 
+    crs (int), optional
+        EPSG code of the metric projection. 
+
+    Returns
+    -------
+    dataframe
+        station x line distance table in meters, indexed by TERMINAL_NUMBER with one column per line NAME. 
+    """
+
+    import shapely
+    metro_lines = gpd.read_file(metro_lines_path).to_crs(epsg=crs)
+    points = gpd.GeoSeries(gpd.points_from_xy(stations.LONGITUDE.values, stations.LATITUDE.values), crs=4326).to_crs(epsg=crs)
+    px, py = points.x.values, points.y.values
+
+    # - - - break every line (and every part of a multi-line) into segments between consecutive vertices
+    parts = metro_lines.geometry.explode(index_parts=False)
+    coords, part_idx = shapely.get_coordinates(parts.values, return_index=True)
+    same_part = part_idx[1:] == part_idx[:-1]
+    seg_a, seg_b = coords[:-1][same_part], coords[1:][same_part]
+    # explode keeps the line's index label, so this maps every segment back to its line (row of metro_lines)
+    seg_line = metro_lines.index.get_indexer(parts.index.values[part_idx[:-1][same_part]])
+
+    table = np.full((len(stations), len(metro_lines)), np.inf)
+    if max_distance is None:
+        # every station against every segment, a block of stations at a time to bound memory
+        order = np.argsort(seg_line, kind='stable')
+        seg_a, seg_b, seg_line = seg_a[order], seg_b[order], seg_line[order]
+        line_start = np.flatnonzero(np.r_[True, seg_line[1:] != seg_line[:-1]])
+        for lo in range(0, len(stations), 256):
+            d = _point_segment_distance(px[lo:lo+256, None], py[lo:lo+256, None], seg_a[:, 0], seg_a[:, 1], seg_b[:, 0], seg_b[:, 1])
+            table[lo:lo+256, seg_line[line_start]] = np.minimum.reduceat(d, line_start, axis=1)
+    else:
+        # the spatial index returns only the (station, segment) pairs within max_distance
+        tree = shapely.STRtree(shapely.linestrings(np.stack([seg_a, seg_b], axis=1)))
+        st, seg = tree.query(shapely.points(px, py), predicate='dwithin', distance=max_distance)
+        d = _point_segment_distance(px[st], py[st], seg_a[seg, 0], seg_a[seg, 1], seg_b[seg, 0], seg_b[seg, 1])
+        np.minimum.at(table, (st, seg_line[seg]), d)
+
+    return pd.DataFrame(table, index=pd.Index(stations.TERMINAL_NUMBER.values, name='TERMINAL_NUMBER'), columns=metro_lines.NAME.values)
+
     
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - 
@@ -617,7 +1123,25 @@ if __name__ == '__main__':
     parser.add_argument('--geoplot', help='activate geographic data map', type = bool, default = False)
     # parser.add_argument('--testgeo', help='activate geographic data map', type = bool, default = False)
     parser.add_argument('--dflim', help = 'limit the number of files used to build main df', type=int, default = 0)
+    parser.add_argument('--aggregates', help = 'write the query service aggregate arrays to this directory', type=str, default = None)
+    parser.add_argument('--store', help = 'write the cleaned trips as a columnar trip store to this directory', type=str, default = None)
+    parser.add_argument('--fromstore', help = 'load the trips from this trip store instead of the csv files', type=str, default = None)
+    parser.add_argument('--sketches', help = 'write monthly per-station duration/rate sketches to this directory', type=str, default = None)
+    parser.add_argument('--distinct', help = 'write monthly distinct bike/route counters to this directory', type=str, default = None)
+    parser.add_argument('--cache', help = 'directory of cached analysis results ("" to disable)', type=str, default = '../cache/')
+    parser.add_argument('--cachesize', help = 'size limit of the result cache in MB', type=int, default = 2048)
+    parser.add_argument('--clearcache', help = 'delete all cached analysis results before running', type=bool, default = False)
+    parser.add_argument('--sample', help = 'use a stratified (station x month x hour) sample of this fraction of the trips, e.g. 0.01', type=float, default = 0)
+    parser.add_argument('--seed', help = 'random seed of --sample', type=int, default = 0)
+    parser.add_argument('--replay', help = 'replay all trips through the stations and report dock stock-outs', type=bool, default = False)
+    parser.add_argument('--dataset', help = 'write the cleaned trips as a year/month partitioned dataset to this directory', type=str, default = None)
+    parser.add_argument('--fromdataset', help = 'load the trips from this partitioned dataset instead of the csv files', type=str, default = None)
+    parser.add_argument('--startdate', help = 'first start date (YYYY-MM-DD) loaded with --fromdataset', type=str, default = None)
+    parser.add_argument('--enddate', help = 'last start date (YYYY-MM-DD) loaded with --fromdataset', type=str, default = None)
     args = parser.parse_args()
+    # the aggregate arrays and the dock replay count every row as one trip, so they need all of the trips
+    if args.sample and (args.aggregates or args.replay):
+        parser.error('--aggregates and --replay count every trip and cannot be combined with --sample')
 
     # - - - Parse the arguments into variable names
     show_barchart = args.barchart
@@ -630,7 +1154,35 @@ if __name__ == '__main__':
     
     # - - -Define the folder containing only data files (csv or txt)
     data_folder = "../data/"
-    df = pd_csv_group(data_folder, dflim)
+    prebuilt = args.fromstore or args.fromdataset
+    if prebuilt:
+        # - - - The trip store / dataset was written after cleaning, so it can be used as-is. The datetime object
+        # columns ('Start date', 'Start time', 'End time') are left out; analyses work on 'Start timestamp' and
+        # add_derived() builds them for the few rows that still need them
+        if args.fromdataset:
+            # only the partitions and row groups of the date range are read
+            dataset = PartitionedTripStore(args.fromdataset)
+            df = dataset.load(start=args.startdate, end=args.enddate, derived=False)
+            print(f'{len(df)/1e6:0.2}M rows of data loaded from dataset {args.fromdataset} ({dataset.last_scan["partitions"]} of {len(dataset.partitions)} partitions)')
+            if args.sample and 'Stratum' not in df.columns:
+                df = stratified_sample(df, args.sample, df['TERMINAL_NUMBER'].values,
+                    df['Start timestamp'].values.astype('datetime64[s]'), seed=args.seed).reset_index(drop=True)
+        else:
+            store = TripStore(args.fromstore)
+            if args.sample and 'Stratum' not in store.columns:
+                # sample on the memory-mapped columns, then build only the sampled rows
+                rows, group, weight = sample_rows(args.sample, store.column('TERMINAL_NUMBER'),
+                    store.column('Start timestamp').astype('datetime64[s]'), seed=args.seed)
+                df = store.frame(derived=False, rows=rows)
+                df['Stratum'] = group
+                df['Sample weight'] = weight
+            else:
+                df = store.frame(derived=False)
+            print(f'{len(df)/1e6:0.2}M rows of data loaded from trip store {args.fromstore}')
+        if args.sample:
+            print(f'{len(df)/1e6:0.2}M rows in the stratified sample')
+    else:
+        df = pd_csv_group(data_folder, dflim, sample=args.sample, seed=args.seed)
     
     # - - - Program appears to hang while handling the remaining code base. Output a "I am thinking" status.
     print('Doing data science...')
@@ -645,21 +1197,60 @@ if __name__ == '__main__':
     # taking only relevant information from the data
     station_locations = station_locations_df[['TERMINAL_NUMBER', 'LATITUDE', 'LONGITUDE','ADDRESS']].copy()
 
-    # we can now merge the new bikestation locations dataframe into the primary dataframe
-    df=df.merge(station_locations, left_on='Start station number', right_on='TERMINAL_NUMBER')
-
-    # - - - Create 'start time' and 'end time' columns after recasting to datetime objects.
-    df['Start time'] =[x.time() for x in pd.to_datetime((df['Start date']))]     
-    df['End time'] =[x.time() for x in pd.to_datetime((df['End date']))]     
+    # - - - Analysis results are cached on disk, keyed by the source files and the call arguments
+    cache = ResultCache(args.cache, max_bytes=args.cachesize*1024**2)
+    if args.clearcache:
+        cache.invalidate()
+    station_csv_key = source_manifest('../misc/Capital_Bike_Share_Locations.csv')
+    data_key = f'{source_manifest(prebuilt if prebuilt else data_folder)}|{args.startdate}|{args.enddate}|{dflim}|{args.sample}|{args.seed}|{station_csv_key}'
+    geo_key = f'{station_csv_key}|{source_manifest("../misc/Metro_Stations_in_DC/Metro_Stations_in_DC.shp")}'
+
+    # - - - Per-station duration percentiles and hourly rate stats, one csv at a time (see sketches.load_period())
+    if args.sketches:
+        build_monthly_sketches(data_folder, args.sketches, station_locations.TERMINAL_NUMBER.values)
+    # - - - Distinct bikes / OD routes per station and day (see sketches.load_distinct())
+    if args.distinct:
+        build_distinct_counters(data_folder, args.distinct)
+
+    if not prebuilt:
+        # we can now merge the new bikestation locations dataframe into the primary dataframe
+        df=df.merge(station_locations, left_on='Start station number', right_on='TERMINAL_NUMBER')
+
+        # - - - Create 'start time' and 'end time' columns after recasting to datetime objects.
+        df['Start time'] =[x.time() for x in pd.to_datetime((df['Start date']))]     
+        # integer seconds since epoch, for the vectorized per-bike trip chains
+        df['Start timestamp'] = pd.to_datetime(df['Start date']).values.astype('datetime64[s]').astype(np.int64)
+        df['End time'] =[x.time() for x in pd.to_datetime((df['End date']))]     
     
-    print('# - - - DATA CLEANING - - - #')
-    # drop unnecessary columns 
-    df.drop(['End date', 'Start station', 'End station', 'Member type'], axis = 1, inplace=True)
-    # drop redundant time from 'start date' col
-    df['Start date'] = df['Start date'].apply(lambda x: x.split(' ')[0])
-    df['Start date'] = df['Start date'].apply(lambda x: dt.date(   int(x.split('-')[0]), int(x.split('-')[1]), int(x.split('-')[2]) ))
-    df.drop('Start station number', axis=1, inplace=True)
-
+        print('# - - - DATA CLEANING - - - #')
+        # drop unnecessary columns 
+        df.drop(['End date', 'Start station', 'End station', 'Member type'], axis = 1, inplace=True)
+        # drop redundant time from 'start date' col
+        df['Start date'] = df['Start date'].apply(lambda x: x.split(' ')[0])
+        df['Start date'] = df['Start date'].apply(lambda x: dt.date(   int(x.split('-')[0]), int(x.split('-')[1]), int(x.split('-')[2]) ))
+        df.drop('Start station number', axis=1, inplace=True)
+
+        # - - - Per-trip distance and implied speed between the start and end stations, with implausible trips flagged
+        # (assigned column by column; concatenating would copy the whole frame)
+        trip_features = trip_distance_speed(df, station_locations)
+        for name in trip_features.columns:
+            df[name] = trip_features[name].values
+
+    # - - - Write the cleaned trips as a memory-mapped columnar store for later runs and worker processes
+    if args.store:
+        write_trip_store(df, args.store)
+    if args.dataset:
+        write_partitioned_store(df, args.dataset)
+
+    # - - - Precompute the arrays served by query_service.py so the dashboard doesn't need a full run per answer
+    if args.aggregates:
+        build_station_aggregates(df, station_locations, args.aggregates)
+
+    # - - - Replay the trips through the docks to find when stations ran empty or full
+    if args.replay:
+        print('# - - - REPLAYING DOCK OCCUPANCY - - - #')
+        dock_replay = DockReplay(df, dock_capacity(station_locations_df))
+        print(dock_replay.stockouts().head(10))
 
     # - - - CLASS OBJECT INSTANTIATION: BIKEREPORT()
     # - - - Which bikes (by bike number) have been used the most (by duration)?
@@ -670,8 +1261,9 @@ if __name__ == '__main__':
     # - - - Generate reports for each of the top ten most used bikes.
     show_bike_reports = False
     if show_bike_reports:
+        _, bike_chains = bike_trip_chains(df)
         for i in range(9):
-            br = BikeReport(df, most_used_bikes_10.iloc[i].name)
+            br = BikeReport(df, most_used_bikes_10.iloc[i].name, chains=bike_chains)
             print(br)
 
     # ADDRESS THE BUSINESS QUESTIONS
@@ -682,9 +1274,9 @@ if __name__ == '__main__':
     # TODO [COMPLETE]: Define a function that returns the popular morning/afternoon/evening bike stations given a start string and stop string of military time.
     print('# - - - DETERMINING POPULAR BIKE STATIONS BY TIME OF DAY - - - #')
 
-    popular_morning_stations =   popular_stations(df, "0400", "0900",top_n=10)
-    popular_afternoon_stations = popular_stations(df, "0900", "1500",top_n=10)
-    popular_evening_stations =   popular_stations(df, "1500", "2359",top_n=10)
+    popular_morning_stations =   cache.call(popular_stations, df, "0400", "0900",top_n=10, data=(df, data_key))
+    popular_afternoon_stations = cache.call(popular_stations, df, "0900", "1500",top_n=10, data=(df, data_key))
+    popular_evening_stations =   cache.call(popular_stations, df, "1500", "2359",top_n=10, data=(df, data_key))
 
 
 
@@ -755,9 +1347,9 @@ if __name__ == '__main__':
     if show_barchart:
         print('# - - - PLOTTING POPULAR STATIONS BY TIME OF DAY - - - #')
 
-        station_time_hist2_pop_morn_stations = station_super_dict(df, popular_morning_stations)
-        station_time_hist2_pop_aft_stations = station_super_dict(df, popular_afternoon_stations)
-        station_time_hist2_pop_eve_stations = station_super_dict(df, popular_evening_stations)
+        station_time_hist2_pop_morn_stations = cache.call(station_super_dict, df, popular_morning_stations, data=(df, data_key))
+        station_time_hist2_pop_aft_stations = cache.call(station_super_dict, df, popular_afternoon_stations, data=(df, data_key))
+        station_time_hist2_pop_eve_stations = cache.call(station_super_dict, df, popular_evening_stations, data=(df, data_key))
         
         # These barcharts need some serious devine intervention...   :/
         plot_popstations(popular_morning_stations, 'Morning')
@@ -774,7 +1366,9 @@ if __name__ == '__main__':
     # we need a distance formula for WTG coords. Enter geopy.distance FTW!
     # source: https://janakiev.com/blog/gps-points-distance-python/
     # for every rail station, find the bike stations that are less than 200m away. 
-    bikestation_prox_railstation_df, distances_dict, pltimg = bikestations_near_railstations(max_distance =200, showplot=True)
+    # (the distances are cached; the plot is drawn from them either way)
+    bikestation_prox_railstation_df, distances_dict, _ = cache.call(bikestations_near_railstations, max_distance =200, depends=geo_key)
+    pltimg = plot_bikestations_near_railstations(distances_dict)
 
     # The "bikestation_prox_railstation_df" effectively contains a filtered copy of the "station_locations" dataframe describing all bike stations. 
     # We can look at the median, mean, and IQR for each of these bike stations over (initially) the last year. 
@@ -792,8 +1386,20 @@ if __name__ == '__main__':
     # lets look at the primary DF and filter by bike stations that have a rail station nearby (given by bikestation_prox_railstation_df)
 
     print('# - - - FILTERING MAIN DATAFRAME FOR BIKE STATIONS WITHIN 200m OF RAIL STATIONS - - - #')
-    df_filtered_for_proximate_railstations = df[df['TERMINAL_NUMBER'].isin(bikestation_prox_railstation_df['TERMINAL_NUMBER'])] 
-    df_time_filtered2019 = df_filtered_for_proximate_railstations[df_filtered_for_proximate_railstations['Start date'].between(dt.date(2018,10,31),dt.date(2019,12,31),inclusive=True)]                                            
+    # loaded from a partitioned dataset, the date range and station set are pushed down to the load, which then only reads those
+    # partitions/row groups (df already holds the trips when the dataset was just written, and a sample drawn at load time is
+    # not in the dataset, so both are filtered in memory)
+    near_rail_dataset = (PartitionedTripStore(args.fromdataset) if args.fromdataset and not args.sample else None)
+    if near_rail_dataset:
+        # stay within the date range df was loaded with, like the in-memory filter does
+        rail_start = max(dt.date(2018,10,31), dt.date.fromisoformat(args.startdate)) if args.startdate else dt.date(2018,10,31)
+        rail_end = min(dt.date(2019,12,31), dt.date.fromisoformat(args.enddate)) if args.enddate else dt.date(2019,12,31)
+        df_time_filtered2019 = near_rail_dataset.load(rail_start, rail_end, stations=bikestation_prox_railstation_df['TERMINAL_NUMBER'], derived=False)
+        print(f'read {near_rail_dataset.last_scan["rows"]/1e6:0.2}M of {len(near_rail_dataset)/1e6:0.2}M rows')
+    else:
+        df_filtered_for_proximate_railstations = df[df['TERMINAL_NUMBER'].isin(bikestation_prox_railstation_df['TERMINAL_NUMBER'])] 
+        rail_ts = df_filtered_for_proximate_railstations['Start timestamp'].values
+        df_time_filtered2019 = df_filtered_for_proximate_railstations[(rail_ts >= np.datetime64('2018-10-31', 's').astype(np.int64)) & (rail_ts < np.datetime64('2020-01-01', 's').astype(np.int64))]                                            
     
     
     '''
@@ -819,10 +1425,11 @@ if __name__ == '__main__':
     '''
     print('# - - - DETERMIMING RATIO OF RENTAL VOLUME BETWEEN "NEAR RAIL" AND "NOT NEAR RAIL" BIKE STATIONS - - - #')
 
-    transaction_total_not_near_rail = df[df['TERMINAL_NUMBER'].isin(terminals_not_near_rail)].size
+    # (trip_count() scales a stratified sample back up to the rides it stands for)
+    transaction_total_not_near_rail = trip_count(df[df['TERMINAL_NUMBER'].isin(terminals_not_near_rail)])
     total_stations_not_near_rail = len(terminals_not_near_rail)
 
-    transaction_total_near_rail = df[df['TERMINAL_NUMBER'].isin(terminals_near_rail)].size
+    transaction_total_near_rail = trip_count(df[df['TERMINAL_NUMBER'].isin(terminals_near_rail)])
     total_stations_near_rail = len(terminals_near_rail)
 
     # Ratio: (bike rentals near a rail station) to (bike rentals not near a rail station)
@@ -869,22 +1476,12 @@ if __name__ == '__main__':
     
     print('# - - - DETERMINING THE WEEKLY VOLUME OF "NEAR RAIL" BIKE STATIONS ACROSS ALL OF DATASET (2010-2019) - - - #')
 
-    stations_near_rail_df = df[df['TERMINAL_NUMBER'].isin(terminals_near_rail)] 
-    weekly_sum_of_rentals_by_station_df = pd.DataFrame(index = [f'{yr}-{wknum}' for yr in range(2010,2020) for wknum in range(1,54) ],
-    columns=[str(x) for x in sorted(list(terminals_near_rail))],data=0)
-    
-    for station in sorted(list(terminals_near_rail)):
-        
-        station_df = stations_near_rail_df[stations_near_rail_df['TERMINAL_NUMBER'] == station].copy().sort_values(by='Start date')
-        station_df['Start date ordinal'] = station_df['Start date'].apply(lambda x: x.toordinal())
-        grpby_dt = station_df.groupby('Start date ordinal')
-        print(f'Aggregating daily usage for Station {station}')
-        
-        for daynum,group_df in grpby_dt:
-            weeknum = dt.date.isocalendar(dt.date.fromordinal(daynum))[1] 
-            yr =dt.date.isocalendar(dt.date.fromordinal(daynum))[0]
-            index_for_df = f'{yr}-{weeknum}'
-            weekly_sum_of_rentals_by_station_df[str(station)].loc[index_for_df]+=group_df.size
+    if near_rail_dataset:
+        # only the near-rail stations' row groups (within the loaded date range, if any) are read
+        near_rail_df = near_rail_dataset.load(start=args.startdate, end=args.enddate, stations=terminals_near_rail, derived=False)
+        weekly_sum_of_rentals_by_station_df = cache.call(weekly_station_volume, near_rail_df, terminals_near_rail, data=(near_rail_df, data_key))
+    else:
+        weekly_sum_of_rentals_by_station_df = cache.call(weekly_station_volume, df, terminals_near_rail, data=(df, data_key))
     
     # Since there are so many lines on top of each other, lets look at just a few that are close to each other. 
     # There are two stations near each other. Lets see how their bike rental activity compares over time. 
@@ -903,7 +1500,11 @@ if __name__ == '__main__':
         station2_name = station_locations[station_locations['TERMINAL_NUMBER']==int(station_terminal_pair[1])].ADDRESS.values[0]
 
         # plot the geometry data for metrolines and metro stations with only two "close proximity" bike stations to compare rental volume
-        plot_geoms(lines=True, metrostations=True, bikestations=False)   
+        # zoomed to the pair, so only the nearby streets are drawn
+        pair = pd.concat([station1, station2])
+        pad = .01
+        pair_extent = (pair.LONGITUDE.min()-pad, pair.LONGITUDE.max()+pad, pair.LATITUDE.min()-pad, pair.LATITUDE.max()+pad)
+        plot_geoms(lines=True, metrostations=True, bikestations=False, extent=pair_extent)   
         plt.scatter(station1.LONGITUDE, station1.LATITUDE,color='r',marker='o', label=station1.ADDRESS.values)
         plt.scatter(station2.LONGITUDE, station2.LATITUDE,color='b',marker='o', label=station2.ADDRESS.values)
         plt.legend()
@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+import datetime as dt
+import os
+import glob
+import pickle
+import hashlib
+
+
+# - - - - - - - - - - - - - - - -
+# - - Content-addressed on-disk memoization of analysis stages. A result
+# - - is keyed by the stage name, a fingerprint of the source data and a
+# - - fingerprint of the call arguments, so changing one parameter only
+# - - recomputes the stages that take it.
+# - - - - - - - - - - - - - - - -
+
+def source_manifest(*paths):
+    """Fingerprint of source files from their names, sizes and modification times (no file contents are read).
+
+    Parameters
+    ----------
+    *paths (str)
+        files, or directories whose files are all included.
+
+    Returns
+    -------
+    str
+        hex digest identifying this exact set of file versions.
+    """
+
+    h = hashlib.sha1()
+    for path in paths:
+        files = (sorted(os.path.join(path, f) for f in os.listdir(path)) if os.path.isdir(path) else [path])
+        for f in files:
+            stat = os.stat(f)
+            h.update(f'{os.path.basename(f)}|{stat.st_size}|{stat.st_mtime_ns};'.encode())
+    return h.hexdigest()
+
+def fingerprint(obj, h=None):
+    ''' feed a canonical, content-based representation of obj (frames, arrays, scalars, containers) to a sha1 hash. '''
+    h = (hashlib.sha1() if h is None else h)
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        names = (list(obj.columns) if isinstance(obj, pd.DataFrame) else [obj.name])
+        h.update(f'{type(obj).__name__}{names}'.encode())
+        h.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+    elif isinstance(obj, np.ndarray):
+        h.update(f'ndarray{obj.dtype}{obj.shape}'.encode())
+        h.update((pd.util.hash_array(obj.ravel()) if obj.dtype == object else np.ascontiguousarray(obj)).tobytes())
+    elif isinstance(obj, dict):
+        h.update(b'dict{')
+        for k in sorted(obj, key=repr):
+            fingerprint(k, h)
+            fingerprint(obj[k], h)
+        h.update(b'}')
+    elif isinstance(obj, (set, frozenset)):
+        fingerprint(sorted(obj, key=repr), h)
+    elif isinstance(obj, (list, tuple)):
+        h.update(f'{type(obj).__name__}['.encode())
+        for item in obj:
+            fingerprint(item, h)
+        h.update(b']')
+    elif obj is None or isinstance(obj, (bool, int, float, str, bytes, np.generic, dt.date, dt.time, dt.datetime)):
+        h.update(f'{type(obj).__name__}:{obj!r};'.encode())
+    else:
+        raise TypeError(f'cannot fingerprint argument of type {type(obj).__name__}')
+    return h
+
+class ResultCache(object):
+    """Size-bounded, least-recently-used cache of analysis results on disk.
+
+    Each result is one pickle (binary, highest protocol) named <stage>-<key>.pkl. A hit refreshes the file's
+    modification time, and when the directory grows past max_bytes the entries with the oldest modification
+    time are deleted first.
+
+    Parameters
+    ----------
+    cache_dir (str)
+        directory holding the results. None disables caching (every call is computed).
+    max_bytes (int), optional
+        size limit of the directory. Defaults to 2GB.
+    """
+
+    def __init__(self, cache_dir, max_bytes=2*1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def call(self, func, *args, data=None, depends=None, **kwargs):
+        """Return func(*args, **kwargs), from the cache when the same stage was run on the same data and arguments.
+
+        Parameters
+        ----------
+        func (function)
+            the analysis stage; its name is the stage name.
+        data (tuple), optional
+            (frame, key): wherever `frame` itself is passed as an argument it is keyed by `key` (e.g. the
+            source_manifest() of the csv files it was built from) instead of by hashing its contents, which is
+            the expensive part for the full trip table. Other arguments are always hashed by content.
+        depends (str), optional
+            fingerprint of inputs func reads besides its arguments, e.g. source_manifest() of a shape file.
+        *args, **kwargs
+            the arguments of func.
+        """
+
+        if not self.cache_dir:
+            return func(*args, **kwargs)
+        stage = func.__name__
+        h = hashlib.sha1(f'{func.__module__}.{stage}|{depends}|'.encode())
+        for arg in list(args) + [kwargs]:
+            if data is not None and arg is data[0]:
+                h.update(f'<data:{data[1]}>'.encode())
+            else:
+                fingerprint(arg, h)
+        path = os.path.join(self.cache_dir, f'{stage}-{h.hexdigest()}.pkl')
+
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+            os.utime(path)
+            print(f'{stage}: loaded from cache')
+            return result
+
+        result = func(*args, **kwargs)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        self.evict()
+        return result
+
+    def evict(self):
+        ''' delete least recently used entries until the cache fits in max_bytes. '''
+        entries = [(os.stat(p).st_mtime, os.stat(p).st_size, p) for p in glob.glob(os.path.join(self.cache_dir, '*.pkl'))]
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(p)
+            total -= size
+
+    def invalidate(self, stage=None):
+        ''' delete the cached results of one stage (function or name), or of every stage if None. '''
+        if not self.cache_dir:
+            return
+        name = (stage if isinstance(stage, str) or stage is None else stage.__name__)
+        for p in glob.glob(os.path.join(self.cache_dir, f'{name}-*.pkl' if name else '*.pkl')):
+            os.remove(p)
@@ -0,0 +1,371 @@
+import numpy as np
+import os
+import json
+import time
+import asyncio
+import argparse
+import datetime as dt
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit, parse_qs
+from timeutil import DAYS, EPOCH_ORDINAL, epoch_day, day_of_week
+
+
+# - - - - - - - - - - - - - - - -
+# - - Local query service for the dashboard team.
+# - - main.py writes the aggregate arrays once (--aggregates), this
+# - - module memory-maps them and answers queries over HTTP.
+# - - - - - - - - - - - - - - - -
+
+MINUTES_PER_DAY = 1440
+
+def build_station_aggregates(df, station_locations, out_dir, metro_stations_path='../misc/Metro_Stations_in_DC/Metro_Stations_in_DC.shp'):
+    """Precompute the per-station and per-bike aggregate arrays served by the query service and write them to disk.
+
+    Parameters
+    ----------
+    df (DataFrame)
+        the cleaned primary dataframe from main.py (needs 'TERMINAL_NUMBER', 'Start timestamp', 'Bike number', 'Duration').
+        Every row counts as one trip, so a stratified sample (with 'Sample weight') is refused.
+    station_locations (DataFrame)
+        bike station locations with 'TERMINAL_NUMBER', 'LATITUDE', 'LONGITUDE', 'ADDRESS'.
+    out_dir (str)
+        directory the .npy arrays and the stations.json metadata file are written to.
+    metro_stations_path (str), optional
+        shape file of the Metro rail stations used for the proximity table.
+
+    Returns
+    -------
+    None
+        writes the aggregate files to out_dir.
+    """
+    if 'Sample weight' in df.columns:
+        raise ValueError('the station aggregates count every trip; build them from all trips, not a sample')
+    # geopandas/geopy are only needed for the one-time build, not for serving
+    import geopandas as gpd
+    from geopy.distance import distance
+
+    os.makedirs(out_dir, exist_ok=True)
+    print('# - - - BUILDING STATION AGGREGATES - - - #')
+
+    # - - - integer station index for every ride
+    terminals = np.unique(df['TERMINAL_NUMBER'].values).astype(np.int64)
+    st_idx = np.searchsorted(terminals, df['TERMINAL_NUMBER'].values)
+    n_stations = len(terminals)
+
+    # - - - checkouts by station and minute of day, stored as a cumulative sum so any window is two lookups
+    start_ts = df['Start timestamp'].values.astype(np.int64)
+    minute = start_ts % 86400 // 60
+    minute_counts = np.bincount(st_idx*MINUTES_PER_DAY + minute, minlength=n_stations*MINUTES_PER_DAY).reshape(n_stations, MINUTES_PER_DAY)
+    minute_cumsum = np.zeros((n_stations, MINUTES_PER_DAY+1), dtype=np.int64)
+    np.cumsum(minute_counts, axis=1, out=minute_cumsum[:, 1:])
+
+    # - - - hourly ride rates: rides per (station, date, hour), histogrammed by (station, weekday, hour)
+    day = epoch_day(start_ts)
+    day_offset = day - day.min()
+    n_days = int(day_offset.max()) + 1
+    key = (st_idx*n_days + day_offset)*24 + minute//60
+    key, rates = np.unique(key, return_counts=True)
+    rate_station = key//(n_days*24)
+    rate_weekday = day_of_week((key//24) % n_days + day.min())
+    rate_hour = key % 24
+    n_bins = int(rates.max()) + 1
+    flat = ((rate_station*7 + rate_weekday)*24 + rate_hour)*n_bins + rates
+    rate_hist = np.bincount(flat, minlength=n_stations*7*24*n_bins).reshape(n_stations, 7, 24, n_bins).astype(np.uint32)
+
+    # - - - bike reports: total duration and trip count per bike number
+    bikes, bike_idx = np.unique(np.asarray(df['Bike number'].values, dtype=str), return_inverse=True)
+    bike_duration = np.bincount(bike_idx, weights=df['Duration'].values).astype(np.int64)
+    bike_trips = np.bincount(bike_idx).astype(np.int64)
+
+    # - - - proximity: distance (m) from every bike station to every rail station
+    metro_stations = gpd.read_file(metro_stations_path)
+    locs = station_locations.drop_duplicates('TERMINAL_NUMBER').set_index('TERMINAL_NUMBER').reindex(terminals)
+    rail_dist = np.full((n_stations, len(metro_stations)), np.inf)
+    for i, (lat, lon) in enumerate(zip(locs.LATITUDE.values, locs.LONGITUDE.values)):
+        if np.isnan(lat) or np.isnan(lon):
+            continue
+        for j, (rx, ry) in enumerate(zip(metro_stations.geometry.x, metro_stations.geometry.y)):
+            rail_dist[i, j] = distance((lat, lon), (ry, rx)).m
+
+    np.save(os.path.join(out_dir, 'terminals.npy'), terminals)
+    np.save(os.path.join(out_dir, 'minute_cumsum.npy'), minute_cumsum)
+    np.save(os.path.join(out_dir, 'rate_hist.npy'), rate_hist)
+    np.save(os.path.join(out_dir, 'bikes.npy'), bikes)
+    np.save(os.path.join(out_dir, 'bike_duration.npy'), bike_duration)
+    np.save(os.path.join(out_dir, 'bike_trips.npy'), bike_trips)
+    np.save(os.path.join(out_dir, 'rail_dist.npy'), rail_dist)
+
+    # JSON has no NaN, so missing station locations become null
+    meta = dict(
+        ADDRESS=[(None if not isinstance(a, str) else a) for a in locs.ADDRESS.values],
+        LATITUDE=[(None if np.isnan(x) else float(x)) for x in locs.LATITUDE.values],
+        LONGITUDE=[(None if np.isnan(x) else float(x)) for x in locs.LONGITUDE.values],
+        RAIL_STATIONS=[str(x) for x in metro_stations.NAME.values],
+        first_date=dt.date.fromordinal(int(day.min()) + EPOCH_ORDINAL).isoformat(),
+        last_date=dt.date.fromordinal(int(day.max()) + EPOCH_ORDINAL).isoformat())
+    with open(os.path.join(out_dir, 'stations.json'), 'w') as f:
+        json.dump(meta, f)
+    print(f'aggregates for {n_stations} stations and {len(bikes)} bikes written to {out_dir}')
+
+class StationAggregates(object):
+    """Opens the aggregate arrays written by build_station_aggregates() and answers queries from them.
+
+    Attributes
+    ----------
+    terminals (ndarray)
+        sorted station terminal numbers; row index for every per-station array.
+    meta (dict)
+        station addresses/coordinates and rail station names from stations.json.
+
+    Parameters
+    ----------
+    agg_dir (str)
+        directory containing the aggregate files.
+    mmap (bool), optional
+        memory-map the arrays instead of reading them into RAM. Defaults to `mmap=True`.
+    """
+
+    def __init__(self, agg_dir, mmap=True):
+        mode = ('r' if mmap else None)
+        load = lambda name: np.load(os.path.join(agg_dir, name), mmap_mode=mode)
+        self.terminals = np.asarray(load('terminals.npy'))
+        self.minute_cumsum = load('minute_cumsum.npy')
+        self.rate_hist = load('rate_hist.npy')
+        self.bikes = load('bikes.npy')
+        self.bike_duration = load('bike_duration.npy')
+        self.bike_trips = load('bike_trips.npy')
+        self.rail_dist = load('rail_dist.npy')
+        with open(os.path.join(agg_dir, 'stations.json')) as f:
+            self.meta = json.load(f)
+
+    def _station_row(self, i):
+        return dict(TERMINAL_NUMBER=int(self.terminals[i]), ADDRESS=self.meta['ADDRESS'][i],
+            LATITUDE=self.meta['LATITUDE'][i], LONGITUDE=self.meta['LONGITUDE'][i])
+
+    def _station_index(self, terminal_number):
+        i = int(np.searchsorted(self.terminals, terminal_number))
+        if i == len(self.terminals) or self.terminals[i] != terminal_number:
+            raise KeyError(f'unknown station terminal number {terminal_number}')
+        return i
+
+    def popular_stations(self, time_start, time_stop, top_n=10):
+        """Same result as main.popular_stations() for a "HHMM" to "HHMM" window (inclusive), as a list of dicts. """
+        m_0 = int(time_start[0:2])*60 + int(time_start[2:4])
+        m_f = int(time_stop[0:2])*60 + int(time_stop[2:4])
+        if m_f < m_0:
+            return []
+        counts = self.minute_cumsum[:, m_f+1] - self.minute_cumsum[:, m_0]
+        order = np.argsort(-counts, kind='stable')[:top_n]
+        return [dict(self._station_row(i), RIDE_COUNT=int(counts[i])) for i in order if counts[i] > 0]
+
+    def station_info(self, terminal_number, daystring):
+        """Mean, median and variance of the hourly ride rate for a station on the given day (like StationStats.info()). """
+        hist = np.asarray(self.rate_hist[self._station_index(terminal_number), DAYS.index(daystring)], dtype=np.int64)
+        values = np.arange(hist.shape[1])
+        data = dict()
+        for hr in range(24):
+            h = hist[hr]
+            n = h.sum()
+            if n == 0:
+                data[f'{hr}hr_rates'] = dict(MEAN=0, MEDIAN=0, VARIANCE=0)
+                continue
+            mean = (h*values).sum()/n
+            var = (h*(values-mean)**2).sum()/n
+            # median of the expanded sample: average of the two middle values
+            cum = np.cumsum(h)
+            lo = int(np.searchsorted(cum, (n-1)//2 + 1))
+            hi = int(np.searchsorted(cum, n//2 + 1))
+            data[f'{hr}hr_rates'] = dict(MEAN=round(float(mean),3), MEDIAN=round((lo+hi)/2,3), VARIANCE=round(float(var),3))
+        return data
+
+    def bike_report(self, bike_number):
+        """Service lifetime and trip count for a bike (like BikeReport). """
+        i = int(np.searchsorted(self.bikes, bike_number))
+        if i == len(self.bikes) or self.bikes[i] != bike_number:
+            raise KeyError(f'unknown bike number {bike_number}')
+        duration = int(self.bike_duration[i])
+        return dict(bike_number=bike_number, duration=dict(days=duration//86400, hours=duration%86400//3600,
+            minutes=duration%3600//60, seconds=duration%60), trips=int(self.bike_trips[i]))
+
+    def proximity(self, max_distance=200):
+        """Bike stations with at least one rail station within max_distance meters (like bikestations_near_railstations()). """
+        close = np.asarray(self.rail_dist) <= max_distance
+        result = list()
+        for i in np.flatnonzero(close.any(axis=1)):
+            rail = [dict(NAME=self.meta['RAIL_STATIONS'][j], distance=int(self.rail_dist[i, j])) for j in np.flatnonzero(close[i])]
+            result.append(dict(self._station_row(i), rail_stations=rail))
+        return result
+
+class LRUCache(object):
+    """A small least-recently-used cache of encoded responses.
+
+    Parameters
+    ----------
+    maxsize (int)
+        maximum number of entries kept before the oldest is evicted.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+class LatencyMetrics(object):
+    """Per-endpoint request counts and latency percentiles over the most recent `window` requests. """
+
+    def __init__(self, window=10000):
+        self.window = window
+        self.samples = dict()
+        self.counts = dict()
+
+    def record(self, endpoint, seconds):
+        if endpoint not in self.samples:
+            self.samples[endpoint] = deque(maxlen=self.window)
+            self.counts[endpoint] = 0
+        self.samples[endpoint].append(seconds)
+        self.counts[endpoint] += 1
+
+    def report(self):
+        out = dict()
+        for endpoint, samples in self.samples.items():
+            ms = np.array(samples)*1e3
+            out[endpoint] = dict(count=self.counts[endpoint], mean_ms=round(float(ms.mean()),4),
+                p50_ms=round(float(np.percentile(ms,50)),4), p90_ms=round(float(np.percentile(ms,90)),4),
+                p99_ms=round(float(np.percentile(ms,99)),4), max_ms=round(float(ms.max()),4))
+        return out
+
+class QueryService(object):
+    """asyncio HTTP service answering dashboard queries from a StationAggregates instance.
+
+    Endpoints (all GET, JSON responses)
+    -----------------------------------
+    /popular?start=0400&stop=0900&top_n=10
+    /station/<terminal_number>?day=Monday
+    /bike/<bike_number>
+    /proximity?max_distance=200
+    /metrics
+
+    Parameters
+    ----------
+    aggregates (StationAggregates)
+        the loaded aggregate arrays.
+    cache_size (int), optional
+        number of responses held in the LRU cache.
+    """
+
+    def __init__(self, aggregates, cache_size=1024):
+        self.agg = aggregates
+        self.cache = LRUCache(cache_size)
+        self.metrics = LatencyMetrics()
+
+    def route(self, path, query):
+        ''' returns (endpoint name, status code, payload) for a request path and its parsed query string. '''
+        parts = [p for p in path.split('/') if p]
+        q = {k: v[-1] for k, v in query.items()}
+        if parts == ['popular']:
+            return 'popular', 200, self.agg.popular_stations(q.get('start','0000'), q.get('stop','2359'), int(q.get('top_n',10)))
+        if len(parts) == 2 and parts[0] == 'station':
+            return 'station', 200, self.agg.station_info(int(parts[1]), q.get('day','Monday'))
+        if len(parts) == 2 and parts[0] == 'bike':
+            return 'bike', 200, self.agg.bike_report(parts[1])
+        if parts == ['proximity']:
+            return 'proximity', 200, self.agg.proximity(float(q.get('max_distance',200)))
+        if parts == ['metrics']:
+            return 'metrics', 200, dict(endpoints=self.metrics.report(), cache=dict(size=len(self.cache.data),
+                hits=self.cache.hits, misses=self.cache.misses))
+        return 'unknown', 404, dict(error=f'no such endpoint: {path}')
+
+    def handle(self, target):
+        ''' answers one request target ("/path?query"), going through the response cache. Returns (status, body bytes). '''
+        t_0 = time.perf_counter()
+        url = urlsplit(target)
+        endpoint = (url.path.strip('/').split('/') or ['unknown'])[0]
+        # metrics must never be served stale
+        cached = (None if endpoint == 'metrics' else self.cache.get(target))
+        if cached is not None:
+            status, body = cached
+        else:
+            try:
+                endpoint, status, payload = self.route(url.path, parse_qs(url.query))
+            except KeyError as err:
+                status, payload = 404, dict(error=str(err.args[0]))
+            except (ValueError, IndexError) as err:
+                status, payload = 400, dict(error=str(err))
+            body = json.dumps(payload).encode()
+            if status == 200 and endpoint != 'metrics':
+                self.cache.put(target, (status, body))
+        self.metrics.record(endpoint, time.perf_counter() - t_0)
+        return status, body
+
+    async def serve_client(self, reader, writer):
+        ''' HTTP/1.1 connection handler with keep-alive. '''
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = True
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    if header.lower().startswith(b'connection:') and b'close' in header.lower():
+                        keep_alive = False
+                try:
+                    method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                except ValueError:
+                    break
+                if method != 'GET':
+                    status, body = 405, b'{"error": "only GET is supported"}'
+                else:
+                    status, body = self.handle(target)
+                reason = {200:'OK', 400:'Bad Request', 404:'Not Found', 405:'Method Not Allowed'}[status]
+                writer.write(f'HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+                    f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1') + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def run(self, host='127.0.0.1', port=8050):
+        server = await asyncio.start_server(self.serve_client, host, port)
+        print(f'serving station aggregates on http://{host}:{port}')
+        async with server:
+            await server.serve_forever()
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# - - - - MAIN  - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--aggregates', help = 'directory of aggregates written by "main.py --aggregates"', type=str, default = '../aggregates/')
+    parser.add_argument('--host', help = 'interface to bind', type=str, default = '127.0.0.1')
+    parser.add_argument('--port', help = 'port to listen on', type=int, default = 8050)
+    parser.add_argument('--cache', help = 'number of responses kept in the LRU cache', type=int, default = 1024)
+    parser.add_argument('--inmemory', help = 'read the arrays into RAM instead of memory-mapping them', type=bool, default = False)
+    args = parser.parse_args()
+
+    service = QueryService(StationAggregates(args.aggregates, mmap=not args.inmemory), cache_size=args.cache)
+    asyncio.run(service.run(args.host, args.port))
@@ -0,0 +1,218 @@
+import numpy as np
+import pandas as pd
+
+
+# - - - - - - - - - - - - - - - -
+# - - Dock occupancy replay: the trips become one sorted stream of
+# - - departure (-1) and arrival (+1) events per station, and every
+# - - station's bike count is stepped through its events, clipped to
+# - - [0, docks]. A departure from an empty station or an arrival at a
+# - - full one is a stock-out (in reality a rebalancing truck or a
+# - - rider moving on made up the difference).
+# - - - - - - - - - - - - - - - -
+
+def dock_capacity(locations_df):
+    ''' docks per station (NUMBER_OF_BIKES + NUMBER_OF_EMPTY_DOCKS of the station locations csv), indexed by TERMINAL_NUMBER. '''
+    docks = locations_df['NUMBER_OF_BIKES'] + locations_df['NUMBER_OF_EMPTY_DOCKS']
+    return pd.Series(docks.values, index=locations_df['TERMINAL_NUMBER'].values).groupby(level=0).max()
+
+def _replay_kernel(first, count, delta, capacity, initial, occupancy, stockout):
+    ''' reference stepping loop over the station-major event stream; compiled with numba when it is installed. '''
+    for s in range(len(first)):
+        occ = initial[s]
+        for i in range(first[s], first[s]+count[s]):
+            occ += delta[i]
+            if occ < 0:
+                occ = 0
+                stockout[i] = -1
+            elif occ > capacity[s]:
+                occ = capacity[s]
+                stockout[i] = 1
+            occupancy[i] = occ
+
+def _replay_numpy(first, count, delta, capacity, initial, occupancy, stockout, chunk=4096):
+    ''' the same stepping, vectorized across stations: the k-th event of every station is applied at once, in blocks of
+    `chunk` events per station. Stations are visited busiest first, so the active ones are always a prefix. '''
+    busiest = np.argsort(-count, kind='stable')
+    first, count, capacity = first[busiest], count[busiest], capacity[busiest].astype(np.int32)
+    occ = initial[busiest].astype(np.int32)
+    for j0 in range(0, int(count.max(initial=0)), chunk):
+        active = int((count > j0).sum())
+        width = min(chunk, int(count[0]) - j0)
+        step = j0 + np.arange(width)
+        valid = step < count[:active, None]
+        idx = np.where(valid, first[:active, None] + step, 0)
+        d = np.where(valid, delta[idx], 0).astype(np.int32)
+        occ_block = np.empty((active, width), dtype=np.int32)
+        out_block = np.empty((active, width), dtype=np.int8)
+        o, cap = occ[:active], capacity[:active]
+        for j in range(width):
+            o = o + d[:, j]
+            out_block[:, j] = (o > cap).astype(np.int8) - (o < 0)
+            o = np.minimum(np.maximum(o, 0), cap)
+            occ_block[:, j] = o
+        occ[:active] = o
+        occupancy[idx[valid]] = occ_block[valid]
+        stockout[idx[valid]] = out_block[valid]
+
+class DockReplay(object):
+    """Replays every trip through the station network and keeps the bike count of each station after each of its events.
+
+    Events are held station-major (all events of the first station in time order, then the next station, ...) in
+    flat arrays, so a station's occupancy time series is one contiguous slice.
+
+    Attributes
+    ----------
+    terminals (ndarray)
+        sorted terminal numbers of every station seen as a start or end station.
+    capacity, initial (ndarray)
+        docks and starting bike count of every station.
+    first, count (ndarray)
+        offset and number of each station's events in the event arrays.
+    time (ndarray)
+        epoch seconds of every event.
+    delta (ndarray)
+        -1 for a departure, +1 for an arrival.
+    occupancy (ndarray)
+        bikes docked at the station right after the event.
+    stockout (ndarray)
+        -1 where a departure found the station empty, +1 where an arrival found it full, 0 otherwise.
+
+    Parameters
+    ----------
+    df (DataFrame)
+        primary dataframe with 'TERMINAL_NUMBER' (start station), 'End station number', 'Start timestamp' and 'Duration'.
+        Every trip moves a bike, so a stratified sample (with 'Sample weight') is refused.
+    capacity (Series)
+        docks per terminal number, e.g. dock_capacity(station_locations_df). Stations missing from it get the median.
+    initial (Series), optional
+        starting bike count per terminal number. Defaults to half of the docks.
+    engine (str), optional
+        'numba' (compiled event loop) or 'numpy' (chunked, vectorized across stations). Defaults to numba when it
+        is installed.
+    chunk (int), optional
+        events per station stepped per block by the numpy engine.
+    """
+
+    def __init__(self, df, capacity, initial=None, engine=None, chunk=4096):
+        if 'Sample weight' in df.columns:
+            raise ValueError('the dock replay needs every trip; replay all trips, not a sample')
+        start = df['Start timestamp'].values.astype(np.int64)
+        end = start + df['Duration'].values.astype(np.int64)
+        start_station = df['TERMINAL_NUMBER'].values
+        end_station = df['End station number'].values
+        self.terminals = np.union1d(np.unique(start_station), np.unique(end_station))
+
+        # - - - one argsort over an integer (station, time, arrivals before departures) key gives the event stream
+        t_0 = start.min()
+        station = np.concatenate([np.searchsorted(self.terminals, start_station), np.searchsorted(self.terminals, end_station)])
+        time = np.concatenate([start, end])
+        delta = np.concatenate([np.full(len(start), -1, dtype=np.int8), np.ones(len(end), dtype=np.int8)])
+        span = 2*(int(time.max()) - t_0 + 1)
+        order = np.argsort(station.astype(np.int64)*span + (time - t_0)*2 + (delta < 0), kind='stable')
+        self.time = time[order]
+        self.delta = delta[order]
+        self.count = np.bincount(station, minlength=len(self.terminals)).astype(np.int64)
+        self.first = np.r_[0, np.cumsum(self.count)[:-1]].astype(np.int64)
+        del station, time, delta, order
+
+        capacity = capacity.reindex(self.terminals)
+        self.capacity = capacity.fillna(capacity.median()).values.astype(np.int32)
+        self.initial = (self.capacity//2 if initial is None
+            else initial.reindex(self.terminals).fillna(0).clip(0, self.capacity).values.astype(np.int32))
+
+        self.occupancy = np.zeros(len(self.time), dtype=np.int16)
+        self.stockout = np.zeros(len(self.time), dtype=np.int8)
+        args = (self.first, self.count, self.delta, self.capacity, self.initial, self.occupancy, self.stockout)
+        kernel = (self._numba_kernel() if engine in (None, 'numba') else None)
+        if kernel is None:
+            if engine == 'numba':
+                raise ImportError('engine="numba" requires numba')
+            _replay_numpy(*args, chunk=chunk)
+        else:
+            kernel(*args)
+
+    @staticmethod
+    def _numba_kernel():
+        try:
+            from numba import njit
+        except ImportError:
+            return None
+        return njit(cache=True)(_replay_kernel)
+
+    def _row(self, terminal_number):
+        row = int(np.searchsorted(self.terminals, terminal_number))
+        if row == len(self.terminals) or self.terminals[row] != terminal_number:
+            raise KeyError(f'no events at station terminal number {terminal_number}')
+        return slice(self.first[row], self.first[row] + self.count[row])
+
+    def station_series(self, terminal_number):
+        ''' occupancy of one station after each of its events, indexed by the event time. '''
+        rows = self._row(terminal_number)
+        return pd.Series(self.occupancy[rows], index=self.time[rows].astype('datetime64[s]'), name=terminal_number)
+
+    def occupancy_grid(self, bucket_minutes=60):
+        """Bikes docked at every station at the end of every time bucket (the last event's occupancy, carried
+        forward through buckets without events).
+
+        Parameters
+        ----------
+        bucket_minutes (int), optional
+            width of the buckets. Defaults to hourly.
+
+        Returns
+        -------
+        tuple
+            (bucket_start, grid): datetime64 bucket start times and the station x bucket int16 occupancy array.
+        """
+
+        width = bucket_minutes*60
+        t_0 = self.time.min() - self.time.min() % width
+        n_buckets = int((self.time.max() - t_0)//width) + 1
+        bucket = (self.time - t_0)//width
+        row = np.repeat(np.arange(len(self.terminals)), self.count)
+        # the last event of every (station, bucket) run, given the station-major time order
+        last = np.r_[(row[1:] != row[:-1]) | (bucket[1:] != bucket[:-1]), True]
+
+        # carry forward the position of the latest event with np.maximum.accumulate; -1 means before any event
+        position = np.full((len(self.terminals), n_buckets), -1, dtype=np.int64)
+        position[row[last], bucket[last]] = np.flatnonzero(last)
+        np.maximum.accumulate(position, axis=1, out=position)
+        grid = np.where(position >= 0, self.occupancy[np.maximum(position, 0)], self.initial[:, None]).astype(np.int16)
+        return (t_0 + width*np.arange(n_buckets)).astype('datetime64[s]'), grid
+
+    def stockouts(self):
+        """Stock-out statistics of every station over the replayed period.
+
+        Returns
+        -------
+        DataFrame
+            Columns: TERMINAL_NUMBER, CAPACITY, EVENTS, EMPTY_DEPARTURES, FULL_ARRIVALS, HOURS_EMPTY, HOURS_FULL,
+            SHARE_EMPTY, SHARE_FULL. Sorted by HOURS_EMPTY descending.
+        """
+
+        t_start, t_end = self.time.min(), self.time.max()
+        row = np.repeat(np.arange(len(self.terminals)), self.count)
+        # every event's state lasts until the station's next event (or the end of the period)
+        last = (self.first + self.count - 1)[self.count > 0]
+        held = np.r_[self.time[1:], t_end] - self.time
+        held[last] = t_end - self.time[last]
+        capacity = self.capacity[row]
+        empty = np.bincount(row, weights=held*(self.occupancy == 0), minlength=len(self.terminals))
+        full = np.bincount(row, weights=held*(self.occupancy >= capacity), minlength=len(self.terminals))
+
+        # before its first event a station holds its initial count
+        before = np.where(self.count > 0, self.time[np.minimum(self.first, len(self.time)-1)] - t_start, t_end - t_start)
+        empty += before*(self.initial == 0)
+        full += before*(self.initial >= self.capacity)
+
+        period = max(t_end - t_start, 1)
+        return pd.DataFrame({'TERMINAL_NUMBER':self.terminals,
+            'CAPACITY':self.capacity,
+            'EVENTS':self.count,
+            'EMPTY_DEPARTURES':np.bincount(row, weights=self.stockout == -1, minlength=len(self.terminals)).astype(np.int64),
+            'FULL_ARRIVALS':np.bincount(row, weights=self.stockout == 1, minlength=len(self.terminals)).astype(np.int64),
+            'HOURS_EMPTY':empty/3600,
+            'HOURS_FULL':full/3600,
+            'SHARE_EMPTY':empty/period,
+            'SHARE_FULL':full/period}).sort_values(by='HOURS_EMPTY', ascending=False).reset_index(drop=True)
@@ -0,0 +1,205 @@
+import numpy as np
+import pandas as pd
+from statistics import NormalDist
+from timeutil import DAYS, day_of_week
+
+
+# - - - - - - - - - - - - - - - -
+# - - Stratified sampling of the trips for fast exploratory runs. Trips
+# - - are ordered by station, month and time of day and taken
+# - - systematically at the sampling fraction, so every station, month and
+# - - hour gets its proportional share. Stations are the explicit strata
+# - - (collapsed with their neighbours where fewer than two trips were
+# - - taken); counts are scaled back up to the stratum sizes, with a
+# - - standard error from collapsed strata of successive sampled trips.
+# - - - - - - - - - - - - - - - -
+
+def sample_rows(fraction, stations, starts, part=0, seed=None):
+    """Systematic sample of the trips in (station, month, time of day) order: with a random start u in [0, 1), the
+    trip at position p of that order is taken when floor(fraction*p + u) steps up. The sample holds fraction*trips
+    (+-1) trips, every station, month and hour gets its share up to rounding, and ones with fewer than
+    1/fraction trips may get none.
+
+    Each station is a stratum weighted by its trips over its sampled trips; stations with fewer than two sampled
+    trips are collapsed with the next ones in the order. For variance estimation the sampled trips of a stratum are
+    paired in the same order into collapsed strata of two (three for the last one when the count is odd).
+
+    Parameters
+    ----------
+    fraction (float)
+        sampling fraction, e.g. 0.01 for 1%.
+    stations (array)
+        start station terminal number of every row.
+    starts (array)
+        start time of every row as datetime64.
+    part (int), optional
+        id of this input when several inputs are sampled separately and concatenated (keeps their strata apart).
+    seed (int), optional
+        seed of the random start, for reproducible samples.
+
+    Returns
+    -------
+    tuple
+        (rows, group, weight): sorted positions of the sampled rows, the key of each row's variance group and
+        the number of trips each row stands for.
+    """
+
+    stations = np.asarray(stations, dtype=np.int64)
+    starts = np.asarray(starts).astype('datetime64[s]')
+    # time of day inside each station-month, so hours (and any time of day window) are contiguous runs;
+    # plain time order would step through the daily cycle at the sampling interval and alias with it
+    order = np.lexsort(((starts - starts.astype('datetime64[D]')).astype(np.int64),
+        starts.astype('datetime64[M]').astype(np.int64), stations))
+    u = np.random.default_rng(seed).random()
+    taken = np.diff(np.floor(fraction*np.arange(len(order)+1) + u)) > 0
+
+    # - - - strata: runs of one station in the order, collapsed forward until they hold two sampled trips
+    sorted_stations = stations[order]
+    run = np.r_[0, np.cumsum(sorted_stations[1:] != sorted_stations[:-1])]
+    run_taken = np.bincount(run, weights=taken).astype(np.int64)
+    stratum = np.empty(len(run_taken), dtype=np.int64)
+    current, held = 0, 0
+    for r, n in enumerate(run_taken):
+        stratum[r] = current
+        held += n
+        if held >= 2:
+            current, held = current + 1, 0
+    if held < 2 and current > 0:
+        # trailing stations without two sampled trips join the last stratum
+        stratum[stratum == current] = current - 1
+    stratum = stratum[run]
+    weight = (np.bincount(stratum) / np.maximum(1, np.bincount(stratum, weights=taken)))[stratum]
+
+    # - - - variance groups: successive sampled trips of a stratum, in pairs
+    picked = np.flatnonzero(taken)
+    stratum, weight = stratum[picked], weight[picked]
+    first = np.r_[0, np.flatnonzero(np.diff(stratum)) + 1]
+    sizes = np.diff(np.r_[first, len(picked)])
+    rank = np.arange(len(picked)) - np.repeat(first, sizes)
+    # an odd last trip joins the pair before it
+    last_odd = (rank == np.repeat(sizes, sizes) - 1) & (rank % 2 == 0) & (rank > 0)
+    pair = (rank - last_odd) // 2
+    group = part*10**12 + stratum*10**6 + pair
+
+    by_row = np.argsort(order[picked])
+    return order[picked][by_row], group[by_row], weight[by_row]
+
+def stratified_sample(df, fraction, stations, starts, part=0, seed=None):
+    """Systematic sample of `fraction` of the trips, stratified by station, month and hour through the
+    (station, month, time of day) order. See sample_rows().
+
+    Parameters
+    ----------
+    df (DataFrame)
+        trips to sample from (raw csv rows or the cleaned dataframe).
+    fraction (float)
+        sampling fraction, e.g. 0.01 for 1%.
+    stations (array)
+        start station terminal number of every row.
+    starts (array)
+        start time of every row as datetime64.
+    part (int), optional
+        id of this input when several inputs are sampled separately and concatenated.
+    seed (int), optional
+        seed of the random start, for reproducible samples.
+
+    Returns
+    -------
+    DataFrame
+        the sampled rows, with 'Stratum' (variance group key) and 'Sample weight' (trips each sampled row stands
+        for) columns.
+    """
+
+    rows, group, weight = sample_rows(fraction, stations, starts, part, seed)
+    sample = df.iloc[rows].copy()
+    sample['Stratum'] = group
+    sample['Sample weight'] = weight
+    return sample
+
+def trip_count(df):
+    ''' number of trips df stands for: the sum of 'Sample weight' for a sample, otherwise its number of rows. '''
+    return (df['Sample weight'].sum() if 'Sample weight' in df.columns else len(df))
+
+def estimate_counts(df, by, mask=None, confidence=0.95):
+    """Estimated number of trips per group in the full data, from a stratified sample.
+
+    Each group's count is the weighted sum sum(w_i * y_i) of its sampled trips (y_i = 1 when the trip is in the
+    group and in mask). Its variance is estimated from the collapsed strata g of stratified_sample() as
+    sum_g (1 - 1/w_g) * n_g/(n_g-1) * sum_(i in g) (w_i*y_i - mean_g(w*y))**2.
+
+    Parameters
+    ----------
+    df (DataFrame)
+        the whole sample, with the columns added by stratified_sample(). Filter with mask rather than
+        beforehand, since the collapsed strata are counted from df.
+    by (str or list)
+        column(s) to group by.
+    mask (array), optional
+        boolean selection of the trips to count (e.g. a time of day window). Defaults to all trips.
+    confidence (float), optional
+        level of the confidence interval. Defaults to `confidence=0.95`.
+
+    Returns
+    -------
+    DataFrame
+        indexed by the group, columns ESTIMATE, STD_ERROR, CI_LOW, CI_HIGH (CI_LOW clipped at 0).
+    """
+
+    by = ([by] if isinstance(by, str) else list(by))
+    n = df.groupby('Stratum').size()
+    w = df.groupby('Stratum')['Sample weight'].first()
+    selected = (df if mask is None else df[np.asarray(mask, dtype=bool)])
+    hits = selected.assign(z=selected['Sample weight'], z2=selected['Sample weight']**2)\
+        .groupby(['Stratum'] + by, observed=True)[['z', 'z2']].sum().reset_index()
+    n_g = hits['Stratum'].map(n).values.astype(np.float64)
+    w_g = hits['Stratum'].map(w).values.astype(np.float64)
+    # the group's other sampled trips have z = 0 and only enter through the group mean
+    squares = hits['z2'].values - hits['z'].values**2 / n_g
+    hits['var'] = np.divide((1 - 1/w_g) * n_g * squares, n_g - 1, out=np.zeros(len(hits)), where=n_g > 1)
+
+    out = hits.groupby(by, observed=True)[['z', 'var']].sum()
+    z = NormalDist().inv_cdf(0.5 + confidence/2)
+    se = np.sqrt(np.maximum(0, out['var'].values))
+    return pd.DataFrame({'ESTIMATE':out['z'].values,
+        'STD_ERROR':se,
+        'CI_LOW':np.maximum(0, out['z'].values - z*se),
+        'CI_HIGH':out['z'].values + z*se}, index=out.index)
+
+def station_rate_estimates(df, station_terminal_number, confidence=0.95):
+    """Estimated mean number of rides per hour at a station, by day of week and hour of day, from a stratified
+    sample. The mean is taken over every such day in the sample's date span, including days without rides.
+
+    Parameters
+    ----------
+    df (DataFrame)
+        the whole cleaned sample ('TERMINAL_NUMBER', 'Start timestamp' and the stratified_sample() columns).
+    station_terminal_number (int)
+        the station.
+    confidence (float), optional
+        level of the confidence interval. Defaults to `confidence=0.95`.
+
+    Returns
+    -------
+    DataFrame
+        indexed by (DAY, HOUR), columns RATE, CI_LOW, CI_HIGH in rides per hour.
+    """
+
+    starts = df['Start timestamp'].values.astype('datetime64[s]')
+    days = starts.astype('datetime64[D]')
+    frame = df[['Stratum', 'Sample weight']].assign(
+        DAY=day_of_week(days.astype(np.int64)),
+        HOUR=(starts - days).astype(np.int64) // 3600)
+    counts = estimate_counts(frame, ['DAY', 'HOUR'], mask=df['TERMINAL_NUMBER'].values == station_terminal_number,
+        confidence=confidence)
+
+    span = np.arange(days.min(), days.max() + 1)
+    days_per_weekday = np.bincount(day_of_week(span.astype(np.int64)), minlength=7)
+    grid = pd.MultiIndex.from_product([range(7), range(24)], names=['DAY', 'HOUR'])
+    counts = counts.reindex(grid, fill_value=0)
+    # weekdays missing from a span shorter than a week have no rides either
+    n_days = np.maximum(1, days_per_weekday[grid.get_level_values('DAY')])
+    rates = pd.DataFrame({'RATE':counts['ESTIMATE'].values / n_days,
+        'CI_LOW':counts['CI_LOW'].values / n_days,
+        'CI_HIGH':counts['CI_HIGH'].values / n_days}, index=grid)
+    rates.index = rates.index.set_levels([DAYS, list(range(24))])
+    return rates
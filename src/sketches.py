@@ -0,0 +1,544 @@
+import numpy as np
+import pandas as pd
+import os
+import glob
+from timeutil import DAYS, epoch_day, day_of_week
+
+
+# - - - - - - - - - - - - - - - -
+# - - Mergeable per-station statistics: log-bucket quantile sketches
+# - - (DDSketch), Welford/Chan moment accumulators and HyperLogLog
+# - - distinct counters, built one month of trips at a time and merged
+# - - for any period.
+# - - - - - - - - - - - - - - - -
+
+class QuantileSketch(object):
+    """A DDSketch for many groups at once: one row of log-spaced bucket counts per group.
+
+    A value x falls in bucket ceil(log_gamma(x)) with gamma = (1+alpha)/(1-alpha), and a quantile is reported as
+    the bucket's midpoint 2*gamma**i/(gamma+1). Every reported quantile is therefore within a relative error of
+    `alpha` of an actual data value at that rank (for values inside [min_value, max_value]; values outside are
+    clamped to the range). Sketches with the same parameters merge exactly by adding their counts, and the
+    memory is fixed at groups x buckets regardless of how many values were added.
+
+    Parameters
+    ----------
+    n_groups (int)
+        number of groups (e.g. stations, or stations x hours).
+    alpha (float), optional
+        relative accuracy. Defaults to `alpha=0.01` (1%).
+    min_value, max_value (float), optional
+        range of values kept at full accuracy.
+    integer (bool), optional
+        the values are integers, so estimates are rounded to the nearest one (exact below 1/(2*alpha)).
+    """
+
+    def __init__(self, n_groups, alpha=0.01, min_value=1.0, max_value=1e7, integer=False):
+        self.alpha = alpha
+        self.integer = integer
+        self.min_value = min_value
+        self.max_value = max_value
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.offset = int(np.ceil(np.log(min_value) / np.log(self.gamma)))
+        n_buckets = int(np.ceil(np.log(max_value) / np.log(self.gamma))) - self.offset + 1
+        self.counts = np.zeros((n_groups, n_buckets), dtype=np.uint32)
+
+    def add(self, groups, values):
+        ''' add values (array) to the sketch of their group (integer array of the same length). '''
+        values = np.clip(np.asarray(values, dtype=np.float64), self.min_value, self.max_value)
+        bucket = np.ceil(np.log(values) / np.log(self.gamma)).astype(np.int64) - self.offset
+        flat = np.bincount(np.asarray(groups, dtype=np.int64)*self.counts.shape[1] + bucket, minlength=self.counts.size)
+        self.counts += flat.reshape(self.counts.shape).astype(np.uint32)
+
+    def merge(self, other):
+        ''' add another sketch with the same parameters and groups into this one. '''
+        if (other.alpha, other.min_value, other.max_value, other.counts.shape) != (self.alpha, self.min_value, self.max_value, self.counts.shape):
+            raise ValueError('can only merge sketches built with the same alpha, value range and groups')
+        self.counts += other.counts
+        return self
+
+    def count(self):
+        return self.counts.sum(axis=1, dtype=np.int64)
+
+    def quantile(self, q, groups=None):
+        """Estimated q-quantile (0 <= q <= 1) for the given groups (all by default); NaN for empty groups. """
+        counts = (self.counts if groups is None else self.counts[groups])
+        cum = np.cumsum(counts, axis=-1, dtype=np.int64)
+        n = cum[..., -1]
+        rank = np.floor(q*(n - 1)).astype(np.int64)
+        bucket = (cum <= rank[..., None]).sum(axis=-1)
+        value = 2 * self.gamma**(bucket + self.offset) / (self.gamma + 1)
+        if self.integer:
+            value = np.round(value)
+        return np.where(n > 0, value, np.nan)
+
+class MomentAccumulator(object):
+    """Count, mean and sum of squared deviations per group, updated with Welford/Chan's parallel formula so
+    accumulators built on separate batches merge to exactly the moments of the combined data.
+
+    Parameters
+    ----------
+    n_groups (int)
+        number of groups.
+    """
+
+    def __init__(self, n_groups):
+        self.n = np.zeros(n_groups, dtype=np.int64)
+        self.mean = np.zeros(n_groups)
+        self.m2 = np.zeros(n_groups)
+
+    def _combine(self, n_b, mean_b, m2_b):
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        safe_n = np.maximum(n, 1)
+        self.mean = self.mean + delta * n_b / safe_n
+        self.m2 = self.m2 + m2_b + delta**2 * self.n * n_b / safe_n
+        self.n = n
+
+    def add(self, groups, values):
+        ''' add a batch of values; the batch moments are computed two-pass per group, then combined. '''
+        groups = np.asarray(groups, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        n_b = np.bincount(groups, minlength=len(self.n))
+        mean_b = np.bincount(groups, weights=values, minlength=len(self.n)) / np.maximum(n_b, 1)
+        m2_b = np.bincount(groups, weights=(values - mean_b[groups])**2, minlength=len(self.n))
+        self._combine(n_b, mean_b, m2_b)
+
+    def merge(self, other):
+        self._combine(other.n, other.mean, other.m2)
+        return self
+
+    def variance(self):
+        ''' population variance (like np.var); 0 for empty groups. '''
+        return np.where(self.n > 0, self.m2 / np.maximum(self.n, 1), 0.0)
+
+class StationSketches(object):
+    """Duration and hourly-rate statistics for every station, per station and per station-hour.
+
+    Attributes
+    ----------
+    terminals (ndarray)
+        sorted terminal numbers; the group index of every sketch. Rides at other stations are ignored.
+    duration (QuantileSketch), duration_moments (MomentAccumulator)
+        ride duration (seconds) per station.
+    hourly_duration (QuantileSketch), hourly_duration_moments (MomentAccumulator)
+        ride duration per station and hour of day (group = station*24 + hour).
+    rates (QuantileSketch), rate_moments (MomentAccumulator)
+        rides per hour per (station, day of week, hour) (group = (station*7 + day)*24 + hour), the quantity
+        StationStats.info() summarizes. Only hours with at least one ride count, as in StationStats.
+
+    Parameters
+    ----------
+    terminals (array)
+        station terminal numbers to keep statistics for.
+    alpha (float), optional
+        relative accuracy of the duration sketches (the rate sketches use 5%; rates are small integers, so their
+        estimates are rounded and exact up to 10 rides per hour).
+    """
+
+    def __init__(self, terminals, alpha=0.01):
+        self.terminals = np.unique(np.asarray(terminals, dtype=np.int64))
+        n = len(self.terminals)
+        self.duration = QuantileSketch(n, alpha)
+        self.duration_moments = MomentAccumulator(n)
+        self.hourly_duration = QuantileSketch(n*24, alpha)
+        self.hourly_duration_moments = MomentAccumulator(n*24)
+        self.rates = QuantileSketch(n*7*24, 0.05, max_value=1e4, integer=True)
+        self.rate_moments = MomentAccumulator(n*7*24)
+
+    def add_trips(self, terminal_numbers, start, duration):
+        """Add a batch of trips. All trips of a given calendar day must arrive in the same batch (e.g. one
+        monthly file), since the hourly rates are counted per batch.
+
+        Parameters
+        ----------
+        terminal_numbers (array)
+            start station of every trip.
+        start (array)
+            start time of every trip (datetime64).
+        duration (array)
+            duration of every trip in seconds.
+        """
+
+        terminal_numbers = np.asarray(terminal_numbers, dtype=np.int64)
+        st = np.searchsorted(self.terminals, terminal_numbers)
+        known = (st < len(self.terminals)) & (self.terminals[np.minimum(st, len(self.terminals)-1)] == terminal_numbers)
+        if not known.any():
+            return
+        st = st[known]
+        ts = np.asarray(start, dtype='datetime64[s]')[known].astype(np.int64)
+        duration = np.asarray(duration, dtype=np.float64)[known]
+        hour = ts % 86400 // 3600
+        day = epoch_day(ts)
+
+        self.duration.add(st, duration)
+        self.duration_moments.add(st, duration)
+        self.hourly_duration.add(st*24 + hour, duration)
+        self.hourly_duration_moments.add(st*24 + hour, duration)
+
+        # rides per (station, date, hour), then grouped by (station, day of week, hour)
+        day_offset = day - day.min()
+        day_span = int(day_offset.max()) + 1
+        key, rate = np.unique((st*day_span + day_offset)*24 + hour, return_counts=True)
+        dayofweek = day_of_week(key//24 % day_span + day.min())
+        group = ((key//(day_span*24))*7 + dayofweek)*24 + key % 24
+        self.rates.add(group, rate)
+        self.rate_moments.add(group, rate)
+
+    def merge(self, other):
+        if not np.array_equal(self.terminals, other.terminals):
+            raise ValueError('can only merge station sketches built for the same terminals')
+        for name in ('duration', 'duration_moments', 'hourly_duration', 'hourly_duration_moments', 'rates', 'rate_moments'):
+            getattr(self, name).merge(getattr(other, name))
+        return self
+
+    def _index(self, terminal_number):
+        i = int(np.searchsorted(self.terminals, terminal_number))
+        if i == len(self.terminals) or self.terminals[i] != terminal_number:
+            raise KeyError(f'no statistics for station terminal number {terminal_number}')
+        return i
+
+    def duration_percentiles(self, terminal_number, percentiles=(50, 90, 99), hour=None):
+        """Ride duration percentiles (seconds) at a station, optionally for one hour of the day.
+
+        Returns
+        -------
+        dict
+            {'p50': ..., 'p90': ..., 'p99': ..., 'MEAN': ..., 'VARIANCE': ..., 'COUNT': ...}
+        """
+        i = self._index(terminal_number)
+        sketch, moments, group = ((self.duration, self.duration_moments, i) if hour is None else
+            (self.hourly_duration, self.hourly_duration_moments, i*24 + hour))
+        out = {f'p{p}': float(sketch.quantile(p/100, [group])[0]) for p in percentiles}
+        out.update(MEAN=float(moments.mean[group]), VARIANCE=float(moments.variance()[group]), COUNT=int(moments.n[group]))
+        return out
+
+    def info(self, terminal_number, daystring):
+        """Mean, median and variance of the hourly ride rate for the given day, like StationStats.info(),
+        from the sketches (for an even number of days the median is the lower middle value, not the average).
+
+        Returns
+        -------
+        DataFrame
+            indexed by '<hour>hr_rates' with columns MEAN, MEDIAN, VARIANCE.
+        """
+        groups = (self._index(terminal_number)*7 + DAYS.index(daystring))*24 + np.arange(24)
+        n = self.rate_moments.n[groups]
+        data = dict(MEAN=np.where(n > 0, np.round(self.rate_moments.mean[groups], 3), 0),
+            MEDIAN=np.where(n > 0, np.round(np.nan_to_num(self.rates.quantile(.5, groups)), 3), 0),
+            VARIANCE=np.round(self.rate_moments.variance()[groups], 3))
+        return pd.DataFrame(data, index=[f'{x}hr_rates' for x in range(24)])
+
+    def save(self, path):
+        arrays = dict(terminals=self.terminals, alpha=self.duration.alpha)
+        for name in ('duration', 'hourly_duration', 'rates'):
+            arrays[f'{name}_counts'] = getattr(self, name).counts
+        for name in ('duration_moments', 'hourly_duration_moments', 'rate_moments'):
+            acc = getattr(self, name)
+            arrays[f'{name}_n'], arrays[f'{name}_mean'], arrays[f'{name}_m2'] = acc.n, acc.mean, acc.m2
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        arrays = np.load(path)
+        self = cls(arrays['terminals'], float(arrays['alpha']))
+        for name in ('duration', 'hourly_duration', 'rates'):
+            getattr(self, name).counts = arrays[f'{name}_counts']
+        for name in ('duration_moments', 'hourly_duration_moments', 'rate_moments'):
+            acc = getattr(self, name)
+            acc.n, acc.mean, acc.m2 = arrays[f'{name}_n'], arrays[f'{name}_mean'], arrays[f'{name}_m2']
+        return self
+
+def build_monthly_sketches(data_folder, sketch_dir, terminals, alpha=0.01):
+    """Reads the trip csv files one at a time and writes one StationSketches file per calendar month
+    (<sketch_dir>/YYYY-MM.npz). A month is saved and dropped as soon as a file without it is read, so only the
+    months of the current file are held in memory. Months spread over several files (or files covering several
+    months) are merged/split accordingly, also when a month comes back after it was saved.
+
+    Parameters
+    ----------
+    data_folder (str)
+        directory containing only the trip csv files.
+    sketch_dir (str)
+        output directory.
+    terminals (array)
+        station terminal numbers to keep statistics for (e.g. station_locations.TERMINAL_NUMBER).
+    alpha (float), optional
+        relative accuracy of the duration sketches.
+
+    Returns
+    -------
+    list
+        the months ('YYYY-MM') written.
+    """
+
+    os.makedirs(sketch_dir, exist_ok=True)
+    months, written = dict(), set()
+
+    def flush(keys):
+        for key in keys:
+            sketch = months.pop(key)
+            path = os.path.join(sketch_dir, f'{key}.npz')
+            if key in written:
+                sketch = StationSketches.load(path).merge(sketch)
+            sketch.save(path)
+            written.add(key)
+
+    for file_num, file in enumerate(sorted(os.listdir(data_folder))):
+        f = pd.read_csv(os.path.join(data_folder, file), usecols=['Duration', 'Start date', 'Start station number'])
+        start = pd.to_datetime(f['Start date']).values.astype('datetime64[s]')
+        month = start.astype('datetime64[M]')
+        print(f'sketching file #{file_num+1} ({file})...')
+        for m in np.unique(month):
+            rows = month == m
+            sketch = StationSketches(terminals, alpha)
+            sketch.add_trips(f['Start station number'].values[rows], start[rows], f['Duration'].values[rows])
+            key = str(m)
+            months[key] = (months[key].merge(sketch) if key in months else sketch)
+        # the files are read in name (i.e. month) order, so months this file did not touch are done
+        flush([key for key in months if key not in set(np.unique(month).astype(str))])
+    flush(list(months))
+    return sorted(written)
+
+def load_period(sketch_dir, first_month=None, last_month=None):
+    """Merge the monthly sketches between first_month and last_month ('YYYY-MM', inclusive; open ended if None).
+
+    Returns
+    -------
+    StationSketches
+        the merged statistics for the period.
+    """
+
+    merged = None
+    for path in sorted(glob.glob(os.path.join(sketch_dir, '*.npz'))):
+        month = os.path.basename(path)[:-4]
+        if (first_month and month < first_month) or (last_month and month > last_month):
+            continue
+        sketch = StationSketches.load(path)
+        merged = (sketch if merged is None else merged.merge(sketch))
+    if merged is None:
+        raise ValueError(f'no monthly sketches in {sketch_dir} for {first_month} to {last_month}')
+    return merged
+
+class DistinctCounter(object):
+    """HyperLogLog distinct counts per (station, day), for any set of stations and any range of days.
+
+    Registers are kept sparse, as (station, day, register, rho) rows holding the maximum rho seen, so a
+    station-day with a handful of bikes costs a handful of rows rather than 2**p bytes. The state is not
+    fixed-size: it holds about one 11 byte row per distinct (station, day, id) until registers collide
+    (at most 2**p rows per station-day), i.e. it grows with the trips counted, a few MB per month of bike
+    counts. Counters merge by concatenating rows and taking the maximum per register, which is exactly the
+    HLL union, and a query folds the selected rows into one dense 2**p register array (4KB at the default
+    p=12). The standard error of an estimate is about 1.04/sqrt(2**p), 1.6% at p=12.
+
+    Parameters
+    ----------
+    p (int), optional
+        number of index bits; 2**p registers per sketch.
+    """
+
+    def __init__(self, p=12):
+        self.p = p
+        self.station = np.zeros(0, dtype=np.int32)
+        self.day = np.zeros(0, dtype=np.int32)
+        self.register = np.zeros(0, dtype=np.uint16)
+        self.rho = np.zeros(0, dtype=np.uint8)
+
+    @staticmethod
+    def hash_ids(ids):
+        ''' vectorized, process-independent 64 bit hashes of an array of ids (strings or integers). '''
+        ids = np.asarray(ids)
+        return pd.util.hash_array(ids.astype(object) if ids.dtype.kind in 'OUS' else ids.astype(np.int64))
+
+    def add(self, stations, days, ids):
+        """Add observations of ids (e.g. bike numbers) at stations on days.
+
+        Parameters
+        ----------
+        stations (array)
+            station terminal numbers.
+        days (array)
+            dates (datetime64) of the observations.
+        ids (array)
+            the ids to count distinct values of.
+        """
+
+        h = self.hash_ids(ids)
+        bits = np.uint64(64 - self.p)
+        register = (h >> bits).astype(np.uint16)
+        w = h & np.uint64((1 << (64 - self.p)) - 1)
+        # rho = position of the leftmost 1 bit in the remaining (64-p) bits; bit length by binary search
+        bit_length = np.zeros(len(w), dtype=np.int64)
+        for shift in (32, 16, 8, 4, 2, 1):
+            high = w >= np.uint64(1 << shift)
+            w = np.where(high, w >> np.uint64(shift), w)
+            bit_length += high*shift
+        bit_length += (w > 0)
+        rho = (64 - self.p - bit_length + 1).astype(np.uint8)
+
+        self.station = np.concatenate([self.station, np.asarray(stations, dtype=np.int32)])
+        self.day = np.concatenate([self.day, np.asarray(days, dtype='datetime64[D]').astype(np.int32)])
+        self.register = np.concatenate([self.register, register])
+        self.rho = np.concatenate([self.rho, rho])
+        self._consolidate()
+
+    def _consolidate(self):
+        ''' keep one row per (station, day, register) with the maximum rho. '''
+        order = np.lexsort((self.rho, self.register, self.day, self.station))
+        station, day, register, rho = self.station[order], self.day[order], self.register[order], self.rho[order]
+        # after sorting by rho last, the final row of every (station, day, register) run has the maximum
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = (station[1:] != station[:-1]) | (day[1:] != day[:-1]) | (register[1:] != register[:-1])
+        self.station, self.day, self.register, self.rho = station[last], day[last], register[last], rho[last]
+
+    def merge(self, *others):
+        ''' union with any number of counters; their rows are concatenated and consolidated once. '''
+        if any(other.p != self.p for other in others):
+            raise ValueError('can only merge counters with the same precision p')
+        counters = (self,) + others
+        self.station = np.concatenate([c.station for c in counters])
+        self.day = np.concatenate([c.day for c in counters])
+        self.register = np.concatenate([c.register for c in counters])
+        self.rho = np.concatenate([c.rho for c in counters])
+        self._consolidate()
+        return self
+
+    def registers(self, stations=None, first_day=None, last_day=None):
+        ''' the dense HLL registers of the union over the given stations (all if None) and days (inclusive, 'YYYY-MM-DD'). '''
+        rows = np.ones(len(self.rho), dtype=bool)
+        if stations is not None:
+            rows &= np.isin(self.station, np.asarray(stations, dtype=np.int32))
+        if first_day is not None:
+            rows &= self.day >= np.datetime64(first_day, 'D').astype(np.int32)
+        if last_day is not None:
+            rows &= self.day <= np.datetime64(last_day, 'D').astype(np.int32)
+        registers = np.zeros(1 << self.p, dtype=np.uint8)
+        np.maximum.at(registers, self.register[rows], self.rho[rows])
+        return registers
+
+    def count(self, stations=None, first_day=None, last_day=None):
+        """Estimated number of distinct ids over the given stations and days.
+
+        Parameters
+        ----------
+        stations (list), optional
+            terminal numbers to include. Defaults to all stations.
+        first_day, last_day (str), optional
+            inclusive date range as 'YYYY-MM-DD'. Defaults to the whole history.
+
+        Returns
+        -------
+        int
+            the estimate.
+        """
+        registers = self.registers(stations, first_day, last_day)
+        m = float(len(registers))
+        alpha = 0.7213 / (1 + 1.079/m)
+        estimate = alpha * m*m / np.sum(2.0**-registers.astype(np.float64))
+        zeros = int((registers == 0).sum())
+        # small range correction: linear counting while registers are still empty
+        if estimate <= 2.5*m and zeros > 0:
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+    def save(self, path):
+        np.savez_compressed(path, p=self.p, station=self.station, day=self.day, register=self.register, rho=self.rho)
+
+    @classmethod
+    def load(cls, path):
+        arrays = np.load(path)
+        self = cls(int(arrays['p']))
+        self.station, self.day, self.register, self.rho = arrays['station'], arrays['day'], arrays['register'], arrays['rho']
+        return self
+
+def build_distinct_counters(data_folder, counter_dir, p=12):
+    """Reads the trip csv files one at a time and writes, per calendar month, a DistinctCounter of the bikes
+    seen at each station (checked out or returned there; <month>.bikes.npz) and one of the origin-destination
+    routes starting at each station (<month>.routes.npz). Every observation is filed under the month of its own
+    day, so a bike checked out on the 30th and returned on the 1st counts at the end station in the new month's
+    file. As in build_monthly_sketches(), a month is saved and dropped once a file without it is read.
+
+    The counters are sparse (see DistinctCounter), so a month's state grows with its traffic: a few MB per month
+    for the bike counts, not a fixed few kilobytes.
+
+    Parameters
+    ----------
+    data_folder (str)
+        directory containing only the trip csv files.
+    counter_dir (str)
+        output directory.
+    p (int), optional
+        HLL precision.
+
+    Returns
+    -------
+    list
+        the months ('YYYY-MM') written.
+    """
+
+    os.makedirs(counter_dir, exist_ok=True)
+    months, written = dict(), set()
+
+    def flush(keys):
+        for key in keys:
+            for kind, counter in zip(('bikes', 'routes'), months.pop(key)):
+                path = os.path.join(counter_dir, f'{key}.{kind}.npz')
+                if key in written:
+                    counter = DistinctCounter.load(path).merge(counter)
+                counter.save(path)
+            written.add(key)
+
+    cols = ['Start date', 'End date', 'Start station number', 'End station number', 'Bike number']
+    for file_num, file in enumerate(sorted(os.listdir(data_folder))):
+        f = pd.read_csv(os.path.join(data_folder, file), usecols=cols)
+        print(f'counting distinct bikes and routes in file #{file_num+1} ({file})...')
+        start = pd.to_datetime(f['Start date']).values.astype('datetime64[D]')
+        end = pd.to_datetime(f['End date']).values.astype('datetime64[D]')
+        start_station = f['Start station number'].values.astype(np.int64)
+        end_station = f['End station number'].values.astype(np.int64)
+        # one integer id per origin-destination pair (terminal numbers are 5 digits)
+        route = start_station*1000000 + end_station
+        month = start.astype('datetime64[M]')
+        # bikes are seen at the start station on the start day and at the end station on the end day
+        bike_station = np.r_[start_station, end_station]
+        bike_day = np.r_[start, end]
+        bike_number = np.r_[f['Bike number'].values, f['Bike number'].values]
+        bike_month = bike_day.astype('datetime64[M]')
+        touched = np.union1d(np.unique(month), np.unique(bike_month))
+        for m in touched:
+            bikes, routes = DistinctCounter(p), DistinctCounter(p)
+            rows = bike_month == m
+            bikes.add(bike_station[rows], bike_day[rows], bike_number[rows])
+            rows = month == m
+            routes.add(start_station[rows], start[rows], route[rows])
+            key = str(m)
+            if key in months:
+                months[key][0].merge(bikes)
+                months[key][1].merge(routes)
+            else:
+                months[key] = (bikes, routes)
+        # the files are read in name (i.e. month) order, so months this file did not touch are done
+        flush([key for key in months if key not in set(touched.astype(str))])
+    flush(list(months))
+    return sorted(written)
+
+def load_distinct(counter_dir, kind='bikes', first_month=None, last_month=None):
+    """Merge the monthly DistinctCounters of one kind ('bikes' or 'routes') between first_month and
+    last_month ('YYYY-MM', inclusive; open ended if None).
+
+    Returns
+    -------
+    DistinctCounter
+        the merged counter for the period.
+    """
+
+    counters = list()
+    for path in sorted(glob.glob(os.path.join(counter_dir, f'*.{kind}.npz'))):
+        month = os.path.basename(path)[:7]
+        if (first_month and month < first_month) or (last_month and month > last_month):
+            continue
+        counters.append(DistinctCounter.load(path))
+    if not counters:
+        raise ValueError(f'no {kind} counters in {counter_dir} for {first_month} to {last_month}')
+    # one concatenation and one consolidation for the whole period instead of one per month
+    return counters[0].merge(*counters[1:])
@@ -0,0 +1,21 @@
+import numpy as np
+
+
+# - - - - - - - - - - - - - - - -
+# - - Day arithmetic on integer epoch seconds ('Start timestamp', naive
+# - - local time) for the vectorized analyses, so days of week and dates
+# - - never go through datetime objects.
+# - - - - - - - - - - - - - - - -
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# dt.date(1970, 1, 1).toordinal()
+EPOCH_ORDINAL = 719163
+
+def epoch_day(ts):
+    ''' days since 1970-01-01 of epoch seconds. '''
+    return np.asarray(ts, dtype=np.int64) // 86400
+
+def day_of_week(day):
+    ''' index into DAYS (Monday == 0) of days since 1970-01-01, which was a Thursday. '''
+    return (np.asarray(day, dtype=np.int64) + 3) % 7
@@ -0,0 +1,353 @@
+import numpy as np
+import pandas as pd
+import os
+import json
+
+
+# - - - - - - - - - - - - - - - -
+# - - Columnar binary trip store: one fixed-width .npy file per column plus
+# - - a meta.json with the category dictionaries. Opened with np.memmap, so
+# - - every process reading the store shares the same OS page cache.
+# - - - - - - - - - - - - - - - -
+
+# these are rebuilt from 'Start timestamp' and 'Duration' as datetime objects, so they are not stored
+DERIVED_COLUMNS = ['Start date', 'Start time', 'End time']
+
+def _compact_dtype(values):
+    ''' smallest integer dtype that holds the given integer array. '''
+    for dtype in (np.int8, np.int16, np.int32, np.int64):
+        info = np.iinfo(dtype)
+        if len(values) == 0 or (values.min() >= info.min and values.max() <= info.max):
+            return dtype
+
+def _derived_columns(start_ts, duration):
+    ''' 'Start date', 'Start time' and 'End time' as datetime objects like main.py builds them, from the epoch seconds
+    of the trip starts and the trip durations. '''
+    start = pd.Series(np.asarray(start_ts, dtype=np.int64).astype('datetime64[s]'))
+    end = start + pd.to_timedelta(np.asarray(duration, dtype=np.int64), unit='s')
+    return {'Start date':start.dt.date.values, 'Start time':start.dt.time.values, 'End time':end.dt.time.values}
+
+def add_derived(df):
+    """Add the derived columns ('Start date', 'Start time', 'End time') to a frame loaded with derived=False. These are
+    Python objects, so derive them on the rows that need them (e.g. one station's trips) rather than on the whole store.
+
+    Parameters
+    ----------
+    df (DataFrame)
+        trips with 'Start timestamp' and 'Duration'.
+
+    Returns
+    -------
+    DataFrame
+        df itself if it already has the derived columns, otherwise a copy with them added.
+    """
+
+    if all(c in df.columns for c in DERIVED_COLUMNS):
+        return df
+    return df.assign(**_derived_columns(df['Start timestamp'].values, df['Duration'].values))
+
+def write_trip_store(df, store_dir, dictionaries=None, row_group=None):
+    """Write the (cleaned) primary dataframe as a columnar binary store.
+
+    Integer columns are downcast to the smallest integer type that fits, flags stay bool, float columns are kept as float64
+    (coordinates must still match station_locations exactly), and string columns are dictionary encoded as
+    integer codes with the dictionary kept in meta.json.
+
+    Parameters
+    ----------
+    df (DataFrame)
+        primary dataframe as built in main.py (must contain 'Start timestamp' and 'Duration').
+    store_dir (str)
+        directory to write the store to.
+    dictionaries (dict), optional
+        column name -> sorted category values to encode with instead of the column's own, so that several stores
+        (e.g. the partitions of write_partitioned_store()) share their dictionaries.
+    row_group (int), optional
+        also record the min/max 'TERMINAL_NUMBER' and 'Start timestamp' of every block of this many rows in
+        meta.json, for skipping blocks when loading with a predicate.
+
+    Returns
+    -------
+    None
+        writes <column>.npy files and meta.json to store_dir.
+    """
+
+    os.makedirs(store_dir, exist_ok=True)
+    meta = dict(rows=len(df), columns=dict())
+    if row_group and len(df):
+        lo = np.arange(0, len(df), row_group)
+        hi = np.r_[lo[1:], len(df)]
+        stations = df['TERMINAL_NUMBER'].values.astype(np.int64)
+        start_ts = df['Start timestamp'].values.astype(np.int64)
+        meta['row_groups'] = np.column_stack([lo, hi,
+            np.minimum.reduceat(stations, lo), np.maximum.reduceat(stations, lo),
+            np.minimum.reduceat(start_ts, lo), np.maximum.reduceat(start_ts, lo)]).tolist()
+    for file_num, name in enumerate(c for c in df.columns if c not in DERIVED_COLUMNS):
+        series = df[name]
+        if pd.api.types.is_bool_dtype(series.dtype):
+            values = series.values.astype(np.bool_)
+            categories = None
+        elif pd.api.types.is_integer_dtype(series.dtype):
+            values = series.values
+            values = values.astype(_compact_dtype(values))
+            categories = None
+        elif pd.api.types.is_float_dtype(series.dtype):
+            values = series.values.astype(np.float64)
+            categories = None
+        elif dictionaries is not None and name in dictionaries:
+            categories = [str(x) for x in dictionaries[name]]
+            codes = pd.Categorical(series.astype(str), categories=categories).codes
+            values = codes.astype(_compact_dtype(codes))
+        else:
+            codes, uniques = pd.factorize(series.astype(str), sort=True)
+            values = codes.astype(_compact_dtype(codes))
+            categories = [str(x) for x in uniques]
+        fname = f'col{file_num:02d}.npy'
+        np.save(os.path.join(store_dir, fname), np.ascontiguousarray(values))
+        meta['columns'][name] = dict(file=fname, dtype=str(values.dtype), categories=categories)
+    with open(os.path.join(store_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    print(f'{len(df)/1e6:0.2}M rows x {len(meta["columns"])} columns written to trip store {store_dir}')
+
+class TripStore(object):
+    """Opens a store written by write_trip_store(). Columns are memory-mapped on first access, so opening
+    the store costs one small JSON read regardless of the number of rows.
+
+    Attributes
+    ----------
+    columns (list)
+        names of the stored columns.
+    categories (dict)
+        column name -> list of category values for dictionary encoded columns.
+
+    Parameters
+    ----------
+    store_dir (str)
+        directory containing meta.json and the column files.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.columns = list(self.meta['columns'].keys())
+        self.categories = {k:v['categories'] for k,v in self.meta['columns'].items() if v['categories'] is not None}
+        self._maps = dict()
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def column(self, name):
+        ''' the raw memory-mapped array for a column (integer codes for dictionary encoded columns). '''
+        if name not in self._maps:
+            self._maps[name] = np.load(os.path.join(self.store_dir, self.meta['columns'][name]['file']), mmap_mode='r')
+        return self._maps[name]
+
+    def code(self, name, value):
+        ''' the integer code of a category value, so filters can run on the codes (-1 if the value is not present). '''
+        categories = self.categories[name]
+        i = int(np.searchsorted(categories, value))
+        return (i if i < len(categories) and categories[i] == value else -1)
+
+    def frame(self, columns=None, derived=True, rows=None):
+        """Build a DataFrame over the memory-mapped columns.
+
+        Parameters
+        ----------
+        columns (list), optional
+            stored columns to include. Defaults to all of them.
+        derived (bool), optional
+            also rebuild 'Start date', 'Start time' and 'End time' as datetime objects like main.py does.
+            These are Python objects and therefore not zero-copy; leave off for pure numeric work and use
+            add_derived() on the subsets that need them.
+        rows (ndarray), optional
+            integer positions or boolean mask selecting a subset of rows.
+
+        Returns
+        -------
+        DataFrame
+            numeric columns are views of the memory maps (when rows is None), dictionary encoded columns are
+            pandas Categoricals over the memory-mapped codes.
+        """
+
+        columns = (self.columns if columns is None else columns)
+        data = dict()
+        for name in columns:
+            values = self.column(name)
+            if rows is not None:
+                values = values[rows]
+            if name in self.categories:
+                data[name] = pd.Categorical.from_codes(values, categories=self.categories[name])
+            else:
+                data[name] = values
+        df = pd.DataFrame(data, copy=False)
+
+        if derived:
+            start_ts = (self.column('Start timestamp') if rows is None else self.column('Start timestamp')[rows])
+            duration = (self.column('Duration') if rows is None else self.column('Duration')[rows])
+            for name, values in _derived_columns(start_ts, duration).items():
+                df[name] = values
+        return df
+
+
+# - - - - - - - - - - - - - - - -
+# - - Date-partitioned dataset: one trip store per start month under
+# - - <dataset_dir>/year=YYYY/month=MM/, rows sorted by station and start
+# - - time, with per row group min/max stats. Loads skip partitions and
+# - - row groups that cannot match the date range and station set.
+# - - - - - - - - - - - - - - - -
+
+def write_partitioned_store(df, dataset_dir, row_group=65536):
+    """Write the (cleaned) primary dataframe as a year/month partitioned dataset of trip stores sharing one set of
+    category dictionaries.
+
+    Parameters
+    ----------
+    df (DataFrame)
+        primary dataframe as built in main.py (must contain 'Start timestamp' and 'TERMINAL_NUMBER').
+    dataset_dir (str)
+        directory to write the dataset to.
+    row_group (int), optional
+        rows per row group. Defaults to `row_group=65536`.
+
+    Returns
+    -------
+    None
+        writes one trip store per month and a meta.json listing them (and the column types) to dataset_dir.
+    """
+
+    os.makedirs(dataset_dir, exist_ok=True)
+    stored = [c for c in df.columns if c not in DERIVED_COLUMNS]
+    dictionaries = {name:np.unique(df[name].astype(str).values).tolist() for name in stored
+        if not (pd.api.types.is_bool_dtype(df[name].dtype) or pd.api.types.is_numeric_dtype(df[name].dtype))}
+    # dataset-wide column types (the partitions' compact integer types can only be narrower), so a load that matches
+    # no partition still returns typed columns
+    columns = dict()
+    for name in stored:
+        series = df[name]
+        if name in dictionaries:
+            columns[name] = dict(dtype=np.dtype(_compact_dtype(np.arange(len(dictionaries[name])))).name, categories=dictionaries[name])
+        elif pd.api.types.is_bool_dtype(series.dtype):
+            columns[name] = dict(dtype='bool', categories=None)
+        elif pd.api.types.is_integer_dtype(series.dtype):
+            columns[name] = dict(dtype=np.dtype(_compact_dtype(series.values)).name, categories=None)
+        else:
+            columns[name] = dict(dtype='float64', categories=None)
+    month = df['Start timestamp'].values.astype('datetime64[s]').astype('datetime64[M]')
+    partitions = list()
+    for m in np.unique(month):
+        part = df[month == m].sort_values(by=['TERMINAL_NUMBER', 'Start timestamp'], kind='stable')
+        year, mon = str(m).split('-')
+        path = os.path.join(f'year={year}', f'month={mon}')
+        write_trip_store(part, os.path.join(dataset_dir, path), dictionaries=dictionaries, row_group=row_group)
+        partitions.append(dict(month=str(m), path=path, rows=len(part)))
+    with open(os.path.join(dataset_dir, 'meta.json'), 'w') as f:
+        json.dump(dict(rows=len(df), row_group=row_group, columns=columns, partitions=partitions), f)
+
+class PartitionedTripStore(object):
+    """Opens a dataset written by write_partitioned_store().
+
+    Attributes
+    ----------
+    partitions (list)
+        dicts of month ('YYYY-MM'), path and rows of every partition.
+    last_scan (dict)
+        partitions, row groups and rows read by the last load(), and the dataset's partitions and rows.
+
+    Parameters
+    ----------
+    dataset_dir (str)
+        directory containing meta.json and the year=/month= partitions.
+    """
+
+    def __init__(self, dataset_dir):
+        self.dataset_dir = dataset_dir
+        with open(os.path.join(dataset_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.partitions = self.meta['partitions']
+        self.last_scan = None
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def _empty_frame(self, columns=None, derived=True):
+        ''' a frame without rows, typed from the dataset's column schema (works for a dataset without partitions too). '''
+        schema = self.meta['columns']
+        data = dict()
+        for name in (schema if columns is None else columns):
+            values = np.zeros(0, dtype=schema[name]['dtype'])
+            data[name] = (values if schema[name]['categories'] is None
+                else pd.Categorical.from_codes(values, categories=schema[name]['categories']))
+        df = pd.DataFrame(data)
+        if derived:
+            for name in DERIVED_COLUMNS:
+                df[name] = np.zeros(0, dtype=object)
+        return df
+
+    def load(self, start=None, end=None, stations=None, columns=None, derived=True):
+        """Load the trips starting between two dates at a set of stations, reading only the partitions and row
+        groups that can hold them.
+
+        Parameters
+        ----------
+        start, end (datetime.date or str), optional
+            first and last start date to include ('YYYY-MM-DD' strings work too). Open ended if None.
+        stations (iterable), optional
+            terminal numbers of the start stations to include. Defaults to all stations.
+        columns (list), optional
+            stored columns to include. Defaults to all of them.
+        derived (bool), optional
+            also rebuild 'Start date', 'Start time' and 'End time' (see TripStore.frame()).
+
+        Returns
+        -------
+        DataFrame
+            the matching trips, partitions in month order.
+        """
+
+        t_lo = (None if start is None else np.datetime64(start, 'D').astype('datetime64[s]').astype(np.int64))
+        t_hi = (None if end is None else (np.datetime64(end, 'D') + 1).astype('datetime64[s]').astype(np.int64))
+        month_lo = (None if start is None else str(np.datetime64(start, 'M')))
+        month_hi = (None if end is None else str(np.datetime64(end, 'M')))
+        stations = (None if stations is None else np.unique(np.asarray(list(stations), dtype=np.int64)))
+
+        frames = list()
+        scan = dict(partitions=0, row_groups=0, rows=0, total_partitions=len(self.partitions), total_rows=len(self))
+        for partition in self.partitions:
+            if (month_lo and partition['month'] < month_lo) or (month_hi and partition['month'] > month_hi):
+                continue
+            store = TripStore(os.path.join(self.dataset_dir, partition['path']))
+            row_groups = store.meta.get('row_groups', [[0, len(store), None, None, None, None]])
+
+            keep = list()
+            for lo, hi, st_min, st_max, ts_min, ts_max in row_groups:
+                if ts_min is not None:
+                    if (t_lo is not None and ts_max < t_lo) or (t_hi is not None and ts_min >= t_hi):
+                        continue
+                    if stations is not None:
+                        i = np.searchsorted(stations, st_min)
+                        if i == len(stations) or stations[i] > st_max:
+                            continue
+                keep.append(np.arange(lo, hi))
+            if not keep:
+                continue
+            scan['partitions'] += 1
+            scan['row_groups'] += len(keep)
+            rows = np.concatenate(keep)
+            scan['rows'] += len(rows)
+
+            # row-level predicate over the surviving row groups only
+            mask = np.ones(len(rows), dtype=bool)
+            if t_lo is not None:
+                mask &= store.column('Start timestamp')[rows] >= t_lo
+            if t_hi is not None:
+                mask &= store.column('Start timestamp')[rows] < t_hi
+            if stations is not None:
+                mask &= np.isin(store.column('TERMINAL_NUMBER')[rows], stations)
+            if mask.any():
+                frames.append(store.frame(columns, derived=derived, rows=rows[mask]))
+        self.last_scan = scan
+
+        if not frames:
+            return self._empty_frame(columns, derived)
+        return pd.concat(frames, axis=0, ignore_index=True)
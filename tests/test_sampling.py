@@ -0,0 +1,72 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from sampling import stratified_sample, estimate_counts, station_rate_estimates
+
+
+def synthetic_trips(n=200000, seed=1):
+    ''' trips over 4 stations of unequal popularity and 90 days, with 'Start timestamp' like main.py. '''
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2018-01-01T00:00:00') + rng.integers(0, 86400*90, n).astype('timedelta64[s]')
+    stations = rng.choice([31000, 31001, 31002, 31003], n, p=[.5, .3, .15, .05])
+    return pd.DataFrame({'TERMINAL_NUMBER':stations, 'Start timestamp':start.astype(np.int64)})
+
+def window_mask(df, first_minute, last_minute):
+    minute = (df['Start timestamp'].values // 60) % 1440
+    return (minute >= first_minute) & (minute <= last_minute)
+
+def test_effective_fraction():
+    df = synthetic_trips()
+    starts = df['Start timestamp'].values.astype('datetime64[s]')
+    for fraction in (0.01, 0.05):
+        sample = stratified_sample(df, fraction, df['TERMINAL_NUMBER'].values, starts, seed=0)
+        assert abs(len(sample) - fraction*len(df)) <= 1
+        assert np.isclose(sample['Sample weight'].sum(), len(df))
+        assert np.allclose(sample['Sample weight'], 1/fraction, rtol=0.01)
+        # every station gets its share up to rounding
+        per_station = sample.groupby('TERMINAL_NUMBER').size() / df.groupby('TERMINAL_NUMBER').size()
+        assert np.allclose(per_station, fraction, rtol=0.01)
+
+def test_interval_coverage():
+    df = synthetic_trips()
+    starts = df['Start timestamp'].values.astype('datetime64[s]')
+    # 04:15 - 08:45, a window that cuts through hours
+    truth = df[window_mask(df, 255, 525)].groupby('TERMINAL_NUMBER').size()
+    covered, widths, errors = list(), list(), list()
+    for seed in range(200):
+        sample = stratified_sample(df, 0.01, df['TERMINAL_NUMBER'].values, starts, seed=seed)
+        est = estimate_counts(sample, 'TERMINAL_NUMBER', mask=window_mask(sample, 255, 525)).reindex(truth.index)
+        covered.append(((est.CI_LOW <= truth) & (truth <= est.CI_HIGH)).values)
+        widths.append((est.CI_HIGH - est.CI_LOW).values)
+        errors.append((est.ESTIMATE - truth).values)
+    # systematic sampling beats the collapsed-strata variance estimate, so the intervals are on the conservative side
+    assert np.mean(covered, axis=0).min() >= 0.90
+    assert (np.concatenate(widths) > 0).all()
+    assert (np.abs(np.mean(errors, axis=0)) < 0.01*truth.values).all()
+
+def test_station_totals_exact():
+    df = synthetic_trips()
+    starts = df['Start timestamp'].values.astype('datetime64[s]')
+    sample = stratified_sample(df, 0.01, df['TERMINAL_NUMBER'].values, starts, seed=0)
+    est = estimate_counts(sample, 'TERMINAL_NUMBER')
+    # stations are explicit strata, so their totals are reproduced
+    assert np.allclose(est.ESTIMATE, df.groupby('TERMINAL_NUMBER').size())
+
+def test_station_rate_estimates():
+    df = synthetic_trips()
+    starts = df['Start timestamp'].values.astype('datetime64[s]')
+    sample = stratified_sample(df, 0.05, df['TERMINAL_NUMBER'].values, starts, seed=0)
+    rates = station_rate_estimates(sample, 31000)
+    # full-data mean rides per hour over every weekday of the span (2018-01-01 is a Monday)
+    station = df[df['TERMINAL_NUMBER'] == 31000]['Start timestamp'].values
+    day, hour = station // 86400, station % 86400 // 3600
+    counts = np.bincount(((day + 3) % 7)*24 + hour, minlength=7*24).reshape(7, 24)
+    days_per_weekday = np.bincount((np.arange(day.min(), day.max() + 1) + 3) % 7, minlength=7)
+    truth = (counts / days_per_weekday[:, None]).ravel()
+    assert rates.shape == (7*24, 3)
+    assert np.isclose((rates.RATE.values.reshape(7, 24)*days_per_weekday[:, None]).sum(), len(station))
+    covered = (rates.CI_LOW.values <= truth) & (truth <= rates.CI_HIGH.values)
+    assert covered.mean() >= 0.85